@@ -0,0 +1,230 @@
+'''
+Business: Единая точка входа для всех API - маршрутизирует запрос в обработчики chats, messages, staff, ratings, auth, clients, qc, knowledge, jira через таблицу маршрутов с общим тёплым пулом соединений и кешами
+Args: event - dict с httpMethod, path (/chats, /messages, ...) или queryStringParameters.route, остальное как у целевой функции
+      context - объект с атрибутами request_id, function_name
+Returns: HTTP response dict целевого обработчика
+'''
+import importlib.util
+import json
+import os
+import sys
+import threading
+import psycopg2
+import psycopg2.pool
+from typing import Dict, Any, List, Optional, Tuple
+
+# Каталог с функциями; при сборке единого деплоя обработчики кладутся рядом с этой функцией
+BACKEND_ROOT = os.environ.get('ROUTER_BACKEND_ROOT', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+POOL_MIN_CONNECTIONS = int(os.environ.get('ROUTER_POOL_MIN', '1'))
+POOL_MAX_CONNECTIONS = int(os.environ.get('ROUTER_POOL_MAX', '10'))
+# Сколько ждать свободного соединения пула; дальше запрос получает отдельное соединение вне пула,
+# а не PoolError от исчерпанного ThreadedConnectionPool
+POOL_CHECKOUT_TIMEOUT = float(os.environ.get('ROUTER_POOL_CHECKOUT_TIMEOUT', '2'))
+
+# Маршрут -> каталог функции. Модуль загружается при первом обращении к маршруту,
+# поэтому холодный старт не платит за импорт обработчиков, которые этому экземпляру не нужны
+ROUTES = {
+    'chats': 'chats',
+    'messages': 'messages',
+    'staff': 'staff',
+    'ratings': 'ratings',
+    'auth': 'auth',
+    'clients': 'clients',
+    'qc': 'qc',
+    'knowledge': 'knowledge',
+    'jira': 'jira',
+}
+
+# Модули backend/shared, вызывающие psycopg2.connect от имени обработчика
+SHARED_CONNECTING_MODULES = ('shared.replica',)
+
+_modules: Dict[str, Any] = {}
+_modules_lock = threading.Lock()
+_pools: Dict[Tuple[str, Any], psycopg2.pool.ThreadedConnectionPool] = {}
+# Свободные места пула: getconn вызывается только после захвата места и не видит пустой пул
+_pool_slots: Dict[Tuple[str, Any], threading.BoundedSemaphore] = {}
+_pools_lock = threading.Lock()
+_request_local = threading.local()
+
+
+class PooledConnection:
+    '''
+    Соединение из общего пула; close() откатывает незавершённую транзакцию и возвращает его в пул.
+    Без пула (пул был исчерпан) - отдельное соединение, close() его просто закрывает
+    '''
+    
+    def __init__(self, pool: Optional[psycopg2.pool.ThreadedConnectionPool],
+                 slots: Optional[threading.BoundedSemaphore], conn):
+        self._pool = pool
+        self._slots = slots
+        self._conn = conn
+        self._released = False
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._conn, name)
+    
+    def close(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        if self._pool is None:
+            self._conn.close()
+            return
+        broken = bool(self._conn.closed)
+        if not broken:
+            try:
+                self._conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        try:
+            self._pool.putconn(self._conn, close=broken)
+        finally:
+            self._slots.release()
+
+
+class PooledDriver:
+    '''Подменяет psycopg2 в загруженных обработчиках: connect() выдаёт соединение из пула по (dsn, фабрике)'''
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(psycopg2, name)
+    
+    def connect(self, dsn: str, connection_factory=None) -> PooledConnection:
+        key = (dsn, connection_factory)
+        factory_kwargs = {'connection_factory': connection_factory} if connection_factory else {}
+        pool = _pools.get(key)
+        if pool is None:
+            with _pools_lock:
+                pool = _pools.get(key)
+                if pool is None:
+                    pool = psycopg2.pool.ThreadedConnectionPool(
+                        POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS, dsn, **factory_kwargs
+                    )
+                    _pool_slots[key] = threading.BoundedSemaphore(POOL_MAX_CONNECTIONS)
+                    _pools[key] = pool
+        slots = _pool_slots[key]
+        if slots.acquire(timeout=POOL_CHECKOUT_TIMEOUT):
+            try:
+                conn = PooledConnection(pool, slots, pool.getconn())
+            except Exception:
+                slots.release()
+                raise
+        else:
+            print(f'Router pool exhausted for {POOL_CHECKOUT_TIMEOUT}s, opening a direct connection')
+            conn = PooledConnection(None, None, psycopg2.connect(dsn, **factory_kwargs))
+        getattr(_request_local, 'checked_out', []).append(conn)
+        return conn
+
+
+_driver = PooledDriver()
+
+
+def load_route(route: str):
+    module = _modules.get(route)
+    if module is None:
+        with _modules_lock:
+            module = _modules.get(route)
+            if module is None:
+                name = ROUTES[route]
+                spec = importlib.util.spec_from_file_location(f'route_{name}', os.path.join(BACKEND_ROOT, name, 'index.py'))
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                module.psycopg2 = _driver
+                # Общие модули, которые сами открывают соединения (реплика), тоже берут их из пула
+                for shared_name in SHARED_CONNECTING_MODULES:
+                    if shared_name in sys.modules:
+                        sys.modules[shared_name].psycopg2 = _driver
+                _modules[route] = module
+    return module
+
+
+def resolve_route(event: Dict[str, Any]) -> Tuple[Optional[str], Dict[str, Any]]:
+    '''Маршрут из первого сегмента пути или параметра route; обработчику уходит событие без него'''
+    params = dict(event.get('queryStringParameters') or {})
+    route = params.pop('route', None)
+    path = event.get('path') or '/'
+    if not route:
+        segments = path.split('?')[0].strip('/').split('/')
+        route = segments[0]
+        path = '/' + '/'.join(segments[1:])
+    if route not in ROUTES:
+        return None, event
+    return route, {**event, 'path': path, 'queryStringParameters': params}
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    route, routed_event = resolve_route(event)
+    if route is None:
+        if event.get('httpMethod') == 'OPTIONS':
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+                    'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id, X-Wal-Position, Idempotency-Key',
+                    'Access-Control-Max-Age': '86400'
+                },
+                'body': '',
+                'isBase64Encoded': False
+            }
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unknown route', 'routes': sorted(ROUTES)}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    
+    # Кеш отозванных токенов живёт в shared.auth_tokens - один модуль на все маршруты процесса
+    module = load_route(route)
+    
+    _request_local.checked_out = []
+    try:
+        return module.handler(routed_event, context)
+    finally:
+        # Соединения, не закрытые обработчиком (например, на пути с ошибкой), возвращаются в пул
+        checked_out: List[PooledConnection] = _request_local.checked_out
+        for conn in checked_out:
+            conn.close()
+
+
+if __name__ == '__main__':
+    # Замер холодного старта: время импорта и первого запроса для пяти отдельных функций и единого роутера.
+    # Каждый вариант запускается в чистом интерпретаторе; без DATABASE_URL первым запросом служит OPTIONS
+    import subprocess
+    
+    bench_routes = ['chats', 'messages', 'staff', 'ratings', 'auth']
+    probe_method = 'GET' if os.environ.get('DATABASE_URL') else 'OPTIONS'
+    probe = (
+        'import importlib.util, json, sys, time\n'
+        'started = time.perf_counter()\n'
+        'spec = importlib.util.spec_from_file_location("m", sys.argv[1])\n'
+        'm = importlib.util.module_from_spec(spec)\n'
+        'spec.loader.exec_module(m)\n'
+        'imported = time.perf_counter()\n'
+        'result = {}\n'
+        'for route in sys.argv[2:]:\n'
+        '    request_started = time.perf_counter()\n'
+        f'    m.handler({{"httpMethod": "{probe_method}", "path": "/" + route, "headers": {{}}, '
+        '"queryStringParameters": {}}, None)\n'
+        '    result[route] = (time.perf_counter() - request_started) * 1000\n'
+        'print(json.dumps({"import_ms": (imported - started) * 1000, "first_request_ms": result}))\n'
+    )
+    
+    def run_probe(path: str, routes: List[str]) -> Dict[str, Any]:
+        output = subprocess.run([sys.executable, '-c', probe, path] + routes, capture_output=True, text=True, check=True)
+        return json.loads(output.stdout.strip().splitlines()[-1])
+    
+    print(f'first request: {probe_method}')
+    separate_total = 0.0
+    for route in bench_routes:
+        result = run_probe(os.path.join(BACKEND_ROOT, route, 'index.py'), [route])
+        total = result['import_ms'] + result['first_request_ms'][route]
+        separate_total += total
+        print(f'  {route:<9} import {result["import_ms"]:7.1f} ms, first request {result["first_request_ms"][route]:7.1f} ms')
+    print(f'separate functions, sum of {len(bench_routes)} cold starts: {separate_total:.1f} ms')
+    
+    result = run_probe(os.path.abspath(__file__), bench_routes)
+    unified_total = result['import_ms'] + sum(result['first_request_ms'].values())
+    print(f'unified router import {result["import_ms"]:.1f} ms')
+    for route in bench_routes:
+        print(f'  {route:<9} first request (includes lazy handler import) {result["first_request_ms"][route]:7.1f} ms')
+    print(f'unified router, one cold start: {unified_total:.1f} ms')
@@ -1,13 +1,132 @@
 '''
-Business: API для аутентификации сотрудников - вход по логину и паролю
-Args: event - dict с httpMethod, body
+Business: API для аутентификации сотрудников - вход по логину и паролю, выдача и отзыв подписанных токенов
+Args: event - dict с httpMethod, body, headers
       context - объект с атрибутами request_id, function_name
-Returns: HTTP response dict с данными пользователя и правами доступа
+Returns: HTTP response dict с данными пользователя, правами доступа и токеном
 '''
+import hashlib
+import hmac
 import json
+import math
 import os
+import sys
+import threading
+import time
+import uuid
 import psycopg2
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+
+# Общий код функций (backend/shared) лежит каталогом выше index.py
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+from shared.auth_tokens import b64encode, decode_token, get_signing_keys
+from shared.passwords import SCRYPT_P, SCRYPT_R, hash_password, scrypt_digest, verify_password
+
+# Время жизни токена в секундах (по умолчанию 12 часов)
+TOKEN_TTL_SECONDS = int(os.environ.get('AUTH_TOKEN_TTL', '43200'))
+
+
+def issue_token(staff_id: int, role: str, permissions: Dict[str, Any]) -> Tuple[str, int]:
+    '''Подписывает токен текущим ключом: v1.<kid>.<payload>.<hmac-sha256>'''
+    keys = get_signing_keys()
+    if not keys:
+        raise RuntimeError('AUTH_TOKEN_SECRETS is not configured')
+    kid, key = next(iter(keys.items()))
+    now = int(time.time())
+    claims = {
+        'sub': staff_id,
+        'role': role,
+        'perms': permissions or {},
+        'iat': now,
+        'exp': now + TOKEN_TTL_SECONDS,
+        'jti': uuid.uuid4().hex
+    }
+    payload = b64encode(json.dumps(claims, separators=(',', ':'), ensure_ascii=False).encode())
+    signing_input = f'v1.{kid}.{payload}'
+    signature = b64encode(hmac.new(key, signing_input.encode(), hashlib.sha256).digest())
+    return f'{signing_input}.{signature}', claims['exp']
+
+
+# Одновременные вычисления KDF (параметры scrypt - в shared/passwords.py)
+KDF_MAX_CONCURRENCY = int(os.environ.get('AUTH_KDF_CONCURRENCY', '2'))
+KDF_QUEUE_TIMEOUT = 2.0
+
+# Token bucket: ёмкость и скорость пополнения (токенов в секунду)
+LOGIN_BUCKET_CAPACITY = 5
+LOGIN_BUCKET_RATE = 5 / 300
+IP_BUCKET_CAPACITY = 20
+IP_BUCKET_RATE = 20 / 300
+LOCAL_BUCKETS_LIMIT = 10000
+
+_kdf_slots = threading.BoundedSemaphore(KDF_MAX_CONCURRENCY)
+_dummy_hash: Optional[str] = None
+_local_buckets: Dict[str, Tuple[float, float]] = {}
+
+
+def get_dummy_hash() -> str:
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(uuid.uuid4().hex)
+    return _dummy_hash
+
+
+def check_local_buckets(buckets: List[Tuple[str, int, float]]) -> int:
+    '''Проверка по последнему известному состоянию бакетов; возвращает Retry-After или 0'''
+    now = time.time()
+    retry_after = 0
+    for key, capacity, rate in buckets:
+        if key in _local_buckets:
+            tokens, updated_at = _local_buckets[key]
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            if tokens < 1:
+                retry_after = max(retry_after, math.ceil((1 - tokens) / rate))
+    return retry_after
+
+
+def consume_shared_buckets(cur, buckets: List[Tuple[str, int, float]]) -> int:
+    '''Атомарно списывает по токену из общих бакетов в Postgres одним запросом'''
+    values = []
+    params: List[Any] = []
+    for key, capacity, rate in buckets:
+        values.append('(%s, %s, %s, CURRENT_TIMESTAMP)')
+        params.extend([key, capacity - 1, rate])
+    cur.execute(
+        f'''INSERT INTO t_p77168343_support_chat_project.auth_throttle AS t (key, tokens, rate, updated_at)
+           VALUES {', '.join(values)}
+           ON CONFLICT (key) DO UPDATE SET
+               tokens = GREATEST(
+                   LEAST(EXCLUDED.tokens + 1,
+                         t.tokens + EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - t.updated_at) * EXCLUDED.rate) - 1,
+                   -1),
+               rate = EXCLUDED.rate,
+               updated_at = CURRENT_TIMESTAMP
+           RETURNING key, tokens, rate''',
+        tuple(params)
+    )
+    if len(_local_buckets) > LOCAL_BUCKETS_LIMIT:
+        _local_buckets.clear()
+    now = time.time()
+    retry_after = 0
+    for key, tokens, rate in cur.fetchall():
+        _local_buckets[key] = (tokens, now)
+        if tokens < 0:
+            retry_after = max(retry_after, math.ceil((1 - tokens) / rate))
+    return retry_after
+
+
+def throttled_response(retry_after: int) -> Dict[str, Any]:
+    return {
+        'statusCode': 429,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Retry-After': str(retry_after)
+        },
+        'body': json.dumps({'error': 'Too many login attempts'}, ensure_ascii=False),
+        'isBase64Encoded': False
+    }
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'POST')
@@ -35,6 +154,42 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     try:
         body = json.loads(event.get('body', '{}'))
+        
+        # Выход: токен попадает в denylist до истечения срока действия
+        if body.get('action') == 'logout':
+            headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+            claims, token_error = decode_token(headers.get('x-auth-token', ''))
+            if token_error:
+                return {
+                    'statusCode': 401,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': token_error}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            
+            conn = psycopg2.connect(os.environ['DATABASE_URL'])
+            cur = conn.cursor()
+            cur.execute(
+                '''DELETE FROM t_p77168343_support_chat_project.revoked_tokens 
+                   WHERE expires_at < CURRENT_TIMESTAMP'''
+            )
+            cur.execute(
+                '''INSERT INTO t_p77168343_support_chat_project.revoked_tokens (jti, staff_id, expires_at)
+                   VALUES (%s, %s, TO_TIMESTAMP(%s))
+                   ON CONFLICT (jti) DO NOTHING''',
+                (claims['jti'], claims['sub'], claims['exp'])
+            )
+            conn.commit()
+            cur.close()
+            conn.close()
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'message': 'Logged out'}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
         login = body.get('login')
         password = body.get('password')
         
@@ -46,18 +201,58 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
+        # Без ключа подписи токен не выдать - отказываем до списания бакетов и перехеширования пароля
+        if not get_signing_keys():
+            return {
+                'statusCode': 503,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Token signing is not configured (AUTH_TOKEN_SECRETS)'}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        source_ip = (event.get('requestContext') or {}).get('identity', {}).get('sourceIp', 'unknown')
+        buckets = [
+            (f'login:{login}', LOGIN_BUCKET_CAPACITY, LOGIN_BUCKET_RATE),
+            (f'ip:{source_ip}', IP_BUCKET_CAPACITY, IP_BUCKET_RATE)
+        ]
+        
+        # Быстрый отказ по локальной копии бакета - без соединения с БД
+        retry_after = check_local_buckets(buckets)
+        if retry_after:
+            return throttled_response(retry_after)
+        
         conn = psycopg2.connect(os.environ['DATABASE_URL'])
         cur = conn.cursor()
         
+        retry_after = consume_shared_buckets(cur, buckets)
+        conn.commit()
+        if retry_after:
+            cur.close()
+            conn.close()
+            return throttled_response(retry_after)
+        
         cur.execute(
-            "SELECT id, login, name, role, permissions FROM staff WHERE login = %s AND password = %s",
-            (login, password)
+            "SELECT id, login, name, role, permissions, password FROM staff WHERE login = %s",
+            (login,)
         )
         row = cur.fetchone()
-        cur.close()
-        conn.close()
         
-        if not row:
+        # Ограничиваем число одновременных вычислений KDF на инстанс
+        if not _kdf_slots.acquire(timeout=KDF_QUEUE_TIMEOUT):
+            cur.close()
+            conn.close()
+            return throttled_response(1)
+        try:
+            # Для несуществующего логина считаем KDF по фиктивному хешу, чтобы не раскрывать его по времени ответа
+            password_ok, needs_rehash = verify_password(password, row[5] if row else get_dummy_hash())
+            if row and password_ok and needs_rehash:
+                new_hash = hash_password(password)
+        finally:
+            _kdf_slots.release()
+        
+        if not row or not password_ok:
+            cur.close()
+            conn.close()
             return {
                 'statusCode': 401,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -65,6 +260,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
+        # Прозрачная миграция: открытый пароль или устаревшие параметры KDF перехешируются при входе
+        if needs_rehash:
+            cur.execute(
+                "UPDATE staff SET password = %s WHERE id = %s AND password = %s",
+                (new_hash, row[0], row[5])
+            )
+        
+        # Успешный вход сбрасывает бакет логина
+        cur.execute(
+            'DELETE FROM t_p77168343_support_chat_project.auth_throttle WHERE key = %s',
+            (buckets[0][0],)
+        )
+        _local_buckets.pop(buckets[0][0], None)
+        conn.commit()
+        cur.close()
+        conn.close()
+        
         result = {
             'id': row[0],
             'login': row[1],
@@ -72,6 +284,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'role': row[3],
             'permissions': row[4]
         }
+        result['token'], result['token_expires_at'] = issue_token(row[0], row[3], row[4])
         
         return {
             'statusCode': 200,
@@ -87,3 +300,12 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': str(e)}, ensure_ascii=False),
             'isBase64Encoded': False
         }
+
+
+if __name__ == '__main__':
+    # Замер стоимости KDF для подбора AUTH_SCRYPT_N на целевом железе
+    for n in (8192, 16384, 32768, 65536):
+        started = time.perf_counter()
+        for _ in range(5):
+            scrypt_digest('benchmark', os.urandom(16), n, SCRYPT_R, SCRYPT_P)
+        print(f'scrypt N={n}: {(time.perf_counter() - started) / 5 * 1000:.1f} ms')
@@ -6,11 +6,288 @@ Returns: HTTP response dict с данными чатов
 '''
 import json
 import os
+import sys
+import threading
+import time
 import psycopg2
-from datetime import datetime, timedelta
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+
+# Общий код функций (backend/shared) лежит каталогом выше index.py
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+from shared.admission import handle_admitted
+from shared.auth_tokens import verify_auth_token
+from shared.idempotency import claim_idempotency_key, store_idempotent_response
+from shared.replica import WalTrackingConnection, connect_for_read, read_url, with_wal_position
+
+# Необязательный async-режим (DB_ASYNC=1): независимые чтения уходят одним конвейером (pipeline)
+# psycopg 3 через пул соединений, который переживает вызовы в прогретом инстансе.
+# asyncio и psycopg 3 импортируются при первом таком чтении - без флага холодный старт за них не платит
+DB_ASYNC = os.environ.get('DB_ASYNC') == '1'
+
+CHAT_TIMER_MINUTES = int(os.environ.get('CHAT_TIMER_MINUTES', '15'))
+# Аренда чата ревьюером ОКК - та же настройка, что у функции qc
+QC_LEASE_SECONDS = int(os.environ.get('QC_LEASE_SECONDS', '900'))
+
+# Окно повторной отдачи изменений в дельта-синхронизации (перекрывает коммиты не по порядку change_seq)
+DELTA_SETTLE_SECONDS = 30
+
+WORKSPACE_MESSAGES_LIMIT = 50
+
+# Жизненный цикл чата: действие -> статусы, из которых оно допустимо.
+# Каждый переход - один условный UPDATE ... WHERE status = ANY(...) RETURNING;
+# если строка не вернулась, переход проиграл гонку или недопустим (409)
+CHAT_TRANSITIONS = {
+    'extend_timer': ('active',),
+    'transfer': ('active',),
+    'escalate': ('active',),
+    'close': ('active',),
+    'qc_review': ('qc',),
+    'reassign': ('active',),
+}
+
+# Прямая смена статуса через PUT {status}: целевой статус -> допустимые исходные
+STATUS_TRANSITIONS = {
+    'active': ('closed',),
+    'qc': ('active',),
+}
+
+
+_async_modules: Optional[tuple] = None
+_async_loop = None
+# Пул на каждый сервер: конвейер читает с того же сервера, что выбрал connect_for_read для запроса
+_async_pools: Dict[str, Any] = {}
+# Цикл событий один на инстанс; запросы из разных потоков (роутер) проходят через него по очереди
+_async_lock = threading.Lock()
+
+
+def load_async_modules() -> tuple:
+    '''(asyncio, AsyncConnectionPool) или пустой кортеж, если psycopg 3 не установлен'''
+    global _async_modules
+    if _async_modules is None:
+        try:
+            import asyncio
+            from psycopg_pool import AsyncConnectionPool
+            _async_modules = (asyncio, AsyncConnectionPool)
+        except ImportError:
+            _async_modules = ()
+    return _async_modules
+
+
+async def _pipelined_fetch(dsn: str, queries: List[Tuple[str, tuple]]) -> List[list]:
+    pool = _async_pools.get(dsn)
+    if pool is None:
+        pool = _async_modules[1](dsn, min_size=1, max_size=int(os.environ.get('DB_POOL_SIZE', '4')), open=False)
+        await pool.open()
+        _async_pools[dsn] = pool
+    async with pool.connection() as aconn:
+        cursors = []
+        async with aconn.pipeline():
+            for sql, params in queries:
+                acur = aconn.cursor()
+                await acur.execute(sql, params)
+                cursors.append(acur)
+        return [await acur.fetchall() for acur in cursors]
+
+
+def fetch_independent(cur, queries: List[Tuple[str, tuple]]) -> List[list]:
+    '''Независимые чтения: в async-режиме - конвейером за один сетевой round trip, иначе по очереди на cur'''
+    global _async_loop
+    if DB_ASYNC and load_async_modules():
+        with _async_lock:
+            if _async_loop is None:
+                _async_loop = _async_modules[0].new_event_loop()
+            return _async_loop.run_until_complete(_pipelined_fetch(read_url(), queries))
+    results = []
+    for sql, params in queries:
+        cur.execute(sql, params)
+        results.append(cur.fetchall())
+    return results
+
+
+def transition_conflict(cur, chat_id, action: str) -> Dict[str, Any]:
+    '''Ответ для неприменённого перехода: 404 если чата нет, иначе 409 с текущим статусом'''
+    cur.execute('SELECT status FROM t_p77168343_support_chat_project.chats WHERE id = %s', (chat_id,))
+    row = cur.fetchone()
+    if not row:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Chat not found'}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    return {
+        'statusCode': 409,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': f'Cannot {action} chat in status {row[0]}', 'status': row[0]}, ensure_ascii=False),
+        'isBase64Encoded': False
+    }
+
+
+def handle_bulk_action(cur, body: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Массовая операция над активными чатами: выборка, переход и статистика по операторам
+    выполняются одним запросом на действие. Возвращает исход по каждому чату
+    '''
+    action = body.get('bulk_action')
+    chat_ids = [int(chat_id) for chat_id in body.get('chat_ids', [])]
+    from_operator_id = body.get('from_operator_id')
+    
+    if action not in ('transfer', 'close', 'extend_timer') or not (chat_ids or from_operator_id):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'bulk_action (transfer/close/extend_timer) and chat_ids or from_operator_id required'}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    
+    if chat_ids:
+        target_filter, target_params = 'id = ANY(%s)', [chat_ids]
+    else:
+        target_filter, target_params = 'operator_id = %s', [int(from_operator_id)]
+    targets_cte = f'''targets AS (
+                   SELECT id, operator_id FROM t_p77168343_support_chat_project.chats
+                   WHERE {target_filter} AND status = ANY(%s)
+                   ORDER BY id
+                   FOR UPDATE
+               )'''
+    target_params.append(list(CHAT_TRANSITIONS['close' if action == 'close' else action]))
+    
+    if action == 'transfer':
+        to_operator_id = body.get('to_operator_id')
+        if to_operator_id:
+            # Все чаты - одному указанному оператору
+            assignment_cte = '''assignment AS (
+                   SELECT id, operator_id AS previous_operator_id, %s::int AS staff_id FROM targets
+               )'''
+            assignment_params = [int(to_operator_id)]
+        else:
+            # Распределение по операторам на линии с учётом текущей нагрузки: у каждого оператора
+            # слоты load+1, load+2, ...; чаты по очереди занимают самые "низкие" свободные слоты
+            assignment_cte = '''candidates AS (
+                   SELECT p.staff_id,
+                          (SELECT COUNT(*) FROM t_p77168343_support_chat_project.chats c 
+                           WHERE c.operator_id = p.staff_id AND c.status = 'active') AS load
+                   FROM t_p77168343_support_chat_project.operator_presence p
+                   WHERE p.status = 'online' AND p.expires_at > CURRENT_TIMESTAMP
+                     AND p.staff_id NOT IN (SELECT operator_id FROM targets WHERE operator_id IS NOT NULL)
+               ), slots AS (
+                   SELECT staff_id, ROW_NUMBER() OVER (ORDER BY slot, staff_id) AS rn
+                   FROM candidates, generate_series(load + 1, load + (SELECT COUNT(*) FROM targets)) AS slot
+               ), numbered AS (
+                   SELECT id, operator_id, ROW_NUMBER() OVER (ORDER BY id) AS rn FROM targets
+               ), assignment AS (
+                   SELECT n.id, n.operator_id AS previous_operator_id, s.staff_id
+                   FROM numbered n JOIN slots s ON s.rn = n.rn
+               )'''
+            assignment_params = []
+        cur.execute(
+            f'''WITH {targets_cte}, {assignment_cte}, updated AS (
+                   UPDATE t_p77168343_support_chat_project.chats ch
+                   SET operator_id = a.staff_id,
+                       timer_expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 minute'
+                   FROM assignment a
+                   WHERE ch.id = a.id
+                   RETURNING ch.id, a.previous_operator_id, ch.operator_id
+               ), stats AS (
+                   INSERT INTO t_p77168343_support_chat_project.operator_chat_stats AS s
+                   (operator_id, date, transferred_chats)
+                   SELECT previous_operator_id, CURRENT_DATE, COUNT(*) FROM updated 
+                   WHERE previous_operator_id IS NOT NULL
+                   GROUP BY previous_operator_id
+                   ON CONFLICT (operator_id, date) 
+                   DO UPDATE SET transferred_chats = s.transferred_chats + EXCLUDED.transferred_chats
+               )
+               SELECT t.id, u.operator_id FROM targets t LEFT JOIN updated u ON u.id = t.id''',
+            tuple(target_params + assignment_params + [CHAT_TIMER_MINUTES])
+        )
+        outcomes = {row[0]: ({'outcome': 'transferred', 'operator_id': row[1]} if row[1] else {'outcome': 'no_operator_available'})
+                    for row in cur.fetchall()}
+    
+    elif action == 'close':
+        resolution = body.get('resolution', 'resolved')
+        final_status = 'qc' if resolution == 'resolved' else 'closed'
+        cur.execute(
+            f'''WITH {targets_cte}, updated AS (
+                   UPDATE t_p77168343_support_chat_project.chats ch
+                   SET status = %s,
+                       closed_at = CURRENT_TIMESTAMP,
+                       resolution = %s,
+                       resolution_comment = %s,
+                       scheduled_for = %s,
+                       handling_time = EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - COALESCE(ch.started_at, CURRENT_TIMESTAMP))::int
+                   FROM targets t
+                   WHERE ch.id = t.id
+                   RETURNING ch.id, ch.operator_id, ch.handling_time
+               ), per_operator AS (
+                   SELECT operator_id, COUNT(*) AS closed_count, SUM(handling_time) AS handling_sum
+                   FROM updated WHERE operator_id IS NOT NULL
+                   GROUP BY operator_id
+               ), stats AS (
+                   INSERT INTO t_p77168343_support_chat_project.operator_chat_stats AS s
+                   (operator_id, date, total_chats, resolved, postponed, avg_handling_time)
+                   SELECT operator_id, CURRENT_DATE, closed_count, 
+                          CASE WHEN %s = 'resolved' THEN closed_count ELSE 0 END,
+                          CASE WHEN %s = 'postponed' THEN closed_count ELSE 0 END,
+                          handling_sum / closed_count
+                   FROM per_operator
+                   ON CONFLICT (operator_id, date) 
+                   DO UPDATE SET 
+                   total_chats = s.total_chats + EXCLUDED.total_chats,
+                   resolved = s.resolved + EXCLUDED.resolved,
+                   postponed = s.postponed + EXCLUDED.postponed,
+                   avg_handling_time = (s.avg_handling_time * s.total_chats + EXCLUDED.avg_handling_time * EXCLUDED.total_chats) / 
+                                       (s.total_chats + EXCLUDED.total_chats)
+               )
+               SELECT id, %s FROM updated''',
+            tuple(target_params + [final_status, resolution, body.get('resolution_comment', ''), body.get('scheduled_for'),
+                                   resolution, resolution, final_status])
+        )
+        outcomes = {row[0]: {'outcome': 'closed', 'status': row[1]} for row in cur.fetchall()}
+    
+    else:
+        cur.execute(
+            f'''WITH {targets_cte}
+               UPDATE t_p77168343_support_chat_project.chats ch
+               SET timer_expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 minute',
+                   timer_extended = ch.timer_extended + 1
+               FROM targets t
+               WHERE ch.id = t.id
+               RETURNING ch.id, ch.timer_expires_at''',
+            tuple(target_params + [CHAT_TIMER_MINUTES])
+        )
+        outcomes = {row[0]: {'outcome': 'extended', 'timer_expires_at': row[1].isoformat()} for row in cur.fetchall()}
+    
+    # Запрошенные id, не попавшие в выборку, уже не активны или не существуют
+    for chat_id in chat_ids:
+        outcomes.setdefault(chat_id, {'outcome': 'conflict'})
+    
+    summary: Dict[str, int] = {}
+    for outcome in outcomes.values():
+        summary[outcome['outcome']] = summary.get(outcome['outcome'], 0) + 1
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'results': [{'id': chat_id, **outcome} for chat_id, outcome in sorted(outcomes.items())],
+            'summary': summary
+        }, ensure_ascii=False),
+        'isBase64Encoded': False
+    }
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    priority = 'poll' if event.get('httpMethod', 'GET') == 'GET' else 'critical'
+    return handle_admitted(event, context, priority, handle_with_wal_position)
+
+
+def handle_with_wal_position(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return with_wal_position(handle_request, event, context)
+
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -19,7 +296,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id, X-Wal-Position, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -27,15 +304,30 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        if method == 'GET':
+            conn = connect_for_read(event)
+        else:
+            conn = psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=WalTrackingConnection)
         cur = conn.cursor()
         
+        claims, auth_error = verify_auth_token(event, cur)
+        if auth_error:
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': auth_error}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
         if method == 'GET':
             params = event.get('queryStringParameters', {}) or {}
             status = params.get('status', 'active')
             operator_id = params.get('operator_id')
             chat_id = params.get('id')
             session_id = params.get('session_id')
+            client_id = params.get('client_id')
             
             # Для портала QC - чаты со статусом 'qc'
             if status == 'qc':
@@ -68,6 +360,138 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'message_count': row[12]
                 } for row in rows]
             
+            # Сводка для аналитики и мониторинга: четыре независимых агрегата
+            elif params.get('overview'):
+                operators_rows, chat_counts, ratings_rows, online_rows = fetch_independent(cur, [
+                    ('''SELECT s.id, s.name, s.status, COALESCE(st.total_chats, 0), COALESCE(st.avg_handling_time, 0),
+                               COALESCE(st.resolved, 0), COALESCE(st.escalated, 0)
+                        FROM t_p77168343_support_chat_project.staff s
+                        LEFT JOIN t_p77168343_support_chat_project.operator_chat_stats st 
+                               ON st.operator_id = s.id AND st.date = CURRENT_DATE
+                        WHERE s.role = 'operator'
+                        ORDER BY s.name''', ()),
+                    ('''SELECT 
+                        (SELECT COUNT(*) FROM t_p77168343_support_chat_project.chats WHERE status = 'active'),
+                        (SELECT COUNT(*) FROM t_p77168343_support_chat_project.chats WHERE status = 'qc')''', ()),
+                    ('''SELECT operator_id, AVG(score), COUNT(*) 
+                        FROM t_p77168343_support_chat_project.chat_ratings 
+                        GROUP BY operator_id''', ()),
+                    ('''SELECT staff_id FROM t_p77168343_support_chat_project.operator_presence 
+                        WHERE status = 'online' AND expires_at > CURRENT_TIMESTAMP''', ())
+                ])
+                ratings = {row[0]: (float(row[1]), row[2]) for row in ratings_rows}
+                online_ids = {row[0] for row in online_rows}
+                operators = [{
+                    'id': row[0],
+                    'name': row[1],
+                    'status': row[2],
+                    'online': row[0] in online_ids,
+                    'chats_today': row[3],
+                    'avg_handling_time': row[4],
+                    'resolved_today': row[5],
+                    'escalated_today': row[6],
+                    'avg_score': round(ratings[row[0]][0], 1) if row[0] in ratings else None,
+                    'ratings_count': ratings[row[0]][1] if row[0] in ratings else 0
+                } for row in operators_rows]
+                total_ratings = sum(count for _, count in ratings.values())
+                result = {
+                    'operators': operators,
+                    'active_chats': chat_counts[0][0],
+                    'qc_chats': chat_counts[0][1],
+                    'chats_today': sum(op['chats_today'] for op in operators),
+                    'avg_qc_score': round(sum(avg * count for avg, count in ratings.values()) / total_ratings, 1) if total_ratings else None,
+                    'operators_online': len(online_ids)
+                }
+            
+            # Рабочее место оператора по чату: чат, последняя страница сообщений, клиент, оценка
+            # и операторы на линии - одним запросом с JSON-агрегацией на стороне Postgres
+            elif params.get('workspace'):
+                workspace_id = int(params['workspace'])
+                messages_limit = min(int(params.get('messages_limit', WORKSPACE_MESSAGES_LIMIT)), 200)
+                cur.execute(
+                    '''SELECT json_build_object(
+                           'chat', (
+                               SELECT row_to_json(x) FROM (
+                                   SELECT c.id, c.client_name, c.client_phone, c.client_id, c.operator_id, 
+                                          s.name AS operator_name, c.status, c.created_at, c.closed_at,
+                                          c.timer_expires_at, c.timer_extended, c.session_id, c.resolution, 
+                                          c.resolution_comment, c.scheduled_for, c.handling_time, c.qc_status
+                                   FROM t_p77168343_support_chat_project.chats c
+                                   LEFT JOIN t_p77168343_support_chat_project.staff s ON c.operator_id = s.id
+                                   WHERE c.id = %s
+                               ) x
+                           ),
+                           'messages', COALESCE((
+                               SELECT json_agg(m ORDER BY m.created_at, m.id) FROM (
+                                   SELECT id, chat_id, sender_type, sender_name, content, created_at
+                                   FROM t_p77168343_support_chat_project.messages
+                                   WHERE chat_id = %s
+                                   ORDER BY created_at DESC, id DESC
+                                   LIMIT %s
+                               ) m
+                           ), '[]'::json),
+                           'client', (
+                               SELECT row_to_json(cl) FROM (
+                                   SELECT id, name, phone, email, session_id, total_chats,
+                                          first_interaction AS first_contact_at, last_interaction AS last_contact_at
+                                   FROM t_p77168343_support_chat_project.clients
+                                   WHERE id = (SELECT client_id FROM t_p77168343_support_chat_project.chats WHERE id = %s)
+                               ) cl
+                           ),
+                           'rating', (
+                               SELECT row_to_json(r) FROM (
+                                   SELECT r.id, r.chat_id, r.operator_id, r.rated_by, s.name AS rater_name, 
+                                          r.score, r.comment, r.created_at
+                                   FROM t_p77168343_support_chat_project.chat_ratings r
+                                   LEFT JOIN t_p77168343_support_chat_project.staff s ON r.rated_by = s.id
+                                   WHERE r.chat_id = %s
+                                   LIMIT 1
+                               ) r
+                           ),
+                           'operators', COALESCE((
+                               SELECT json_agg(o ORDER BY o.name) FROM (
+                                   SELECT s.id, s.name, s.role
+                                   FROM t_p77168343_support_chat_project.operator_presence p
+                                   JOIN t_p77168343_support_chat_project.staff s ON s.id = p.staff_id
+                                   WHERE p.status = 'online' AND p.expires_at > CURRENT_TIMESTAMP
+                               ) o
+                           ), '[]'::json)
+                       )''',
+                    (workspace_id, workspace_id, messages_limit + 1, workspace_id, workspace_id)
+                )
+                result = cur.fetchone()[0]
+                if result['chat'] is None:
+                    result = None
+                else:
+                    # Запрошено на одно сообщение больше, чтобы узнать, есть ли более ранние
+                    result['has_more_messages'] = len(result['messages']) > messages_limit
+                    result['messages'] = result['messages'][-messages_limit:] if messages_limit else []
+            
+            # История чатов клиента - по индексу (client_id, created_at)
+            elif client_id:
+                cur.execute(
+                    '''SELECT c.id, c.operator_id, s.name as operator_name, c.status, c.created_at, c.closed_at,
+                       c.resolution, c.resolution_comment, c.handling_time
+                       FROM t_p77168343_support_chat_project.chats c
+                       LEFT JOIN t_p77168343_support_chat_project.staff s ON c.operator_id = s.id
+                       WHERE c.client_id = %s
+                       ORDER BY c.created_at DESC
+                       LIMIT %s''',
+                    (client_id, min(int(params.get('limit', 50)), 200))
+                )
+                rows = cur.fetchall()
+                result = [{
+                    'id': row[0],
+                    'operator_id': row[1],
+                    'operator_name': row[2],
+                    'status': row[3],
+                    'created_at': row[4].isoformat() if row[4] else None,
+                    'closed_at': row[5].isoformat() if row[5] else None,
+                    'resolution': row[6],
+                    'resolution_comment': row[7],
+                    'handling_time': row[8]
+                } for row in rows]
+            
             # Поиск по session_id (для восстановления чата клиента)
             elif session_id:
                 cur.execute(
@@ -120,6 +544,64 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'session_id': row[9]
                 } if row else None
             
+            # Дельта списка оператора: только изменённые с курсора чаты и надгробия ушедших из статуса
+            elif params.get('since') is not None and operator_id:
+                since = int(params['since'])
+                cur.execute(
+                    '''SELECT 
+                       (SELECT last_value FROM t_p77168343_support_chat_project.chat_change_seq),
+                       (SELECT pruned_through_seq FROM t_p77168343_support_chat_project.chat_sync_state WHERE id = 1)'''
+                )
+                current_seq, pruned_through_seq = cur.fetchone()
+                
+                if 0 < since < (pruned_through_seq or 0):
+                    result = {'seq': current_seq, 'reset': True, 'changed': [], 'removed': []}
+                else:
+                    # Недавние изменения отдаются повторно: транзакция с меньшим change_seq
+                    # могла закоммититься позже, чем клиент получил курсор
+                    cur.execute(
+                        '''SELECT c.id, c.client_name, c.client_phone, c.operator_id, 
+                           s.name as operator_name, c.status, c.created_at, c.closed_at,
+                           c.timer_expires_at, c.resolution, c.scheduled_for,
+                           (SELECT COUNT(*) FROM t_p77168343_support_chat_project.messages m WHERE m.chat_id = c.id)
+                           FROM t_p77168343_support_chat_project.chats c
+                           LEFT JOIN t_p77168343_support_chat_project.staff s ON c.operator_id = s.id
+                           WHERE c.operator_id = %s AND c.status = %s
+                             AND (c.change_seq > %s OR c.updated_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+                           ORDER BY c.created_at DESC''',
+                        (int(operator_id), status, since, DELTA_SETTLE_SECONDS)
+                    )
+                    changed = [{
+                        'id': row[0],
+                        'client_name': row[1],
+                        'client_phone': row[2],
+                        'operator_id': row[3],
+                        'operator_name': row[4],
+                        'status': row[5],
+                        'created_at': row[6].isoformat() if row[6] else None,
+                        'closed_at': row[7].isoformat() if row[7] else None,
+                        'timer_expires_at': row[8].isoformat() if row[8] else None,
+                        'resolution': row[9],
+                        'scheduled_for': row[10].isoformat() if row[10] else None,
+                        'message_count': row[11]
+                    } for row in cur.fetchall()]
+                    
+                    removed = []
+                    if since > 0:
+                        cur.execute(
+                            '''SELECT DISTINCT t.chat_id FROM t_p77168343_support_chat_project.chat_tombstones t
+                               WHERE t.operator_id = %s AND t.status = %s
+                                 AND (t.seq > %s OR t.removed_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+                                 AND NOT EXISTS (
+                                     SELECT 1 FROM t_p77168343_support_chat_project.chats c 
+                                     WHERE c.id = t.chat_id AND c.operator_id = t.operator_id AND c.status = t.status
+                                 )''',
+                            (int(operator_id), status, since, DELTA_SETTLE_SECONDS)
+                        )
+                        removed = [row[0] for row in cur.fetchall()]
+                    
+                    result = {'seq': current_seq, 'reset': False, 'changed': changed, 'removed': removed}
+            
             # Список чатов (активные/закрытые) для оператора
             else:
                 query = '''SELECT c.id, c.client_name, c.client_phone, c.operator_id, 
@@ -195,67 +677,84 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 print(f"Session ID: {session_id}")
                 
-                # Автоназначение оператора на линии
-                operator_id = None
-                try:
-                    cur.execute(
-                        '''SELECT id FROM t_p77168343_support_chat_project.staff 
-                           WHERE on_line = true 
-                           ORDER BY RANDOM() 
-                           LIMIT 1'''
-                    )
-                    operator_row = cur.fetchone()
-                    if operator_row:
-                        operator_id = operator_row[0]
-                        print(f"Auto-assigned operator ID: {operator_id}")
-                    else:
-                        print("No operators online, chat will be unassigned")
-                except Exception as e:
-                    print(f"Warning: Could not auto-assign operator: {e}")
-                    operator_id = None
+                idempotency_key, replay = claim_idempotency_key(cur, event, 'chat')
+                if replay:
+                    conn.rollback()
+                    cur.close()
+                    conn.close()
+                    return replay
                 
-                # Сохранить или обновить клиента в БД
-                client_email = body_data.get('client_email', '')
+                # Сохранить или обновить клиента в БД (поиск по session_id, затем по нормализованному телефону)
+                client_email = body.get('client_email', '')
+                client_id = None
                 print(f"Saving/updating client: {client_name}, {client_phone}, {client_email}")
+                cur.execute('SAVEPOINT save_client')
                 try:
                     cur.execute(
-                        '''INSERT INTO t_p77168343_support_chat_project.clients 
-                           (session_id, name, phone, email, first_contact_at, last_contact_at, total_chats)
-                           VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, 1)
-                           ON CONFLICT (session_id) 
-                           DO UPDATE SET 
-                               last_contact_at = CURRENT_TIMESTAMP,
-                               total_chats = t_p77168343_support_chat_project.clients.total_chats + 1,
-                               updated_at = CURRENT_TIMESTAMP''',
-                        (session_id, client_name, client_phone, client_email if client_email else None)
+                        '''WITH found AS (
+                               SELECT id FROM (
+                                   SELECT id, 1 AS priority FROM t_p77168343_support_chat_project.clients WHERE session_id = %s
+                                   UNION ALL
+                                   SELECT id, 2 AS priority FROM t_p77168343_support_chat_project.clients 
+                                   WHERE phone_normalized = regexp_replace(%s, '\\D', '', 'g') AND %s <> ''
+                               ) matches ORDER BY priority LIMIT 1
+                           ), updated AS (
+                               UPDATE t_p77168343_support_chat_project.clients 
+                               SET last_interaction = CURRENT_TIMESTAMP,
+                                   total_chats = total_chats + 1,
+                                   email = COALESCE(%s, email)
+                               WHERE id = (SELECT id FROM found)
+                               RETURNING id
+                           ), inserted AS (
+                               INSERT INTO t_p77168343_support_chat_project.clients 
+                               (session_id, name, phone, email, first_interaction, last_interaction, total_chats)
+                               SELECT %s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP, 1
+                               WHERE NOT EXISTS (SELECT 1 FROM found)
+                               RETURNING id
+                           )
+                           SELECT id FROM updated UNION ALL SELECT id FROM inserted''',
+                        (session_id, client_phone or '', client_phone or '', client_email if client_email else None,
+                         session_id, client_name, client_phone or f'unknown_{session_id}', client_email if client_email else None)
                     )
+                    client_id = cur.fetchone()[0]
+                    cur.execute('RELEASE SAVEPOINT save_client')
                     print("Client saved/updated successfully")
                 except Exception as client_err:
+                    cur.execute('ROLLBACK TO SAVEPOINT save_client')
                     print(f"Warning: Could not save client: {client_err}")
                 
-                # Создать чат с таймером 15 минут
-                timer_expires = datetime.now() + timedelta(minutes=15)
-                print(f"Creating chat with timer expires at: {timer_expires}")
-                cur.execute(
-                    '''INSERT INTO t_p77168343_support_chat_project.chats 
-                       (client_name, client_phone, operator_id, session_id, 
-                        timer_expires_at, started_at, status)
-                       VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP, 'active') 
-                       RETURNING id''',
-                    (client_name, client_phone, operator_id, session_id, timer_expires)
-                )
-                chat_id = cur.fetchone()[0]
-                print(f"Chat created with ID: {chat_id}")
-                
-                # Сохранить первое сообщение
-                print(f"Saving first message...")
+                # Создать чат с таймером 15 минут, автоназначением оператора на линии и первым сообщением -
+                # один запрос вместо отдельных выборки оператора и двух вставок
                 cur.execute(
-                    '''INSERT INTO t_p77168343_support_chat_project.messages 
-                       (chat_id, sender_type, sender_name, content, created_at)
-                       VALUES (%s, 'client', %s, %s, CURRENT_TIMESTAMP)''',
-                    (chat_id, client_name, message_text)
+                    '''WITH chat AS (
+                           INSERT INTO t_p77168343_support_chat_project.chats 
+                           (client_name, client_phone, operator_id, session_id, client_id,
+                            timer_expires_at, started_at, status)
+                           VALUES (%s, %s, 
+                                   (SELECT staff_id FROM t_p77168343_support_chat_project.operator_presence 
+                                    WHERE status = 'online' AND expires_at > CURRENT_TIMESTAMP 
+                                    ORDER BY RANDOM() 
+                                    LIMIT 1),
+                                   %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 minute', CURRENT_TIMESTAMP, 'active') 
+                           RETURNING id, operator_id
+                       ), first_message AS (
+                           INSERT INTO t_p77168343_support_chat_project.messages 
+                           (chat_id, sender_type, sender_name, content, created_at)
+                           SELECT id, 'client', %s, %s, CURRENT_TIMESTAMP FROM chat
+                       )
+                       SELECT id, operator_id FROM chat''',
+                    (client_name, client_phone, session_id, client_id, CHAT_TIMER_MINUTES, client_name, message_text)
                 )
+                chat_id, operator_id = cur.fetchone()
+                print(f"Chat created with ID: {chat_id}, operator: {operator_id}")
                 
+                result = {
+                    'id': chat_id, 
+                    'message': 'Chat created',
+                    'operator_id': operator_id,
+                    'session_id': session_id
+                }
+                store_idempotent_response(cur, 'chat', idempotency_key, 201, result)
                 conn.commit()
                 print("Transaction committed successfully")
                 cur.close()
@@ -264,12 +763,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 return {
                     'statusCode': 201,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'id': chat_id, 
-                        'message': 'Chat created',
-                        'operator_id': operator_id,
-                        'session_id': session_id
-                    }, ensure_ascii=False),
+                    'body': json.dumps(result, ensure_ascii=False),
                     'isBase64Encoded': False
                 }
             except Exception as post_error:
@@ -280,6 +774,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         elif method == 'PUT':
             body = json.loads(event.get('body', '{}'))
+            
+            # Массовые операции (передача/закрытие/продление) по списку id или по всем активным чатам оператора
+            if body.get('bulk_action'):
+                response = handle_bulk_action(cur, body)
+                if response['statusCode'] == 200:
+                    conn.commit()
+                cur.close()
+                conn.close()
+                return response
+            
             chat_id = body.get('id')
             
             if not chat_id:
@@ -292,15 +796,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             # Продление таймера на 15 минут
             if body.get('extend_timer'):
-                new_expires = datetime.now() + timedelta(minutes=15)
                 cur.execute(
                     '''UPDATE t_p77168343_support_chat_project.chats 
-                       SET timer_expires_at = %s, timer_extended = timer_extended + 1
-                       WHERE id = %s
+                       SET timer_expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 minute', 
+                           timer_extended = timer_extended + 1
+                       WHERE id = %s AND status = ANY(%s)
                        RETURNING id, timer_expires_at''',
-                    (new_expires, chat_id)
+                    (CHAT_TIMER_MINUTES, chat_id, list(CHAT_TRANSITIONS['extend_timer']))
                 )
                 row = cur.fetchone()
+                if not row:
+                    response = transition_conflict(cur, chat_id, 'extend_timer')
+                    cur.close()
+                    conn.close()
+                    return response
                 conn.commit()
                 cur.close()
                 conn.close()
@@ -315,25 +824,33 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            # Передача другому оператору
+            # Передача другому оператору: UPDATE применяется, только если чат всё ещё у того же
+            # оператора, что был прочитан при выборе следующего (иначе параллельная передача уже прошла)
             if body.get('transfer_to_next'):
                 cur.execute(
-                    '''SELECT id FROM t_p77168343_support_chat_project.staff 
-                       WHERE on_line = true AND id != (SELECT operator_id FROM t_p77168343_support_chat_project.chats WHERE id = %s)
-                       ORDER BY RANDOM() 
-                       LIMIT 1''',
-                    (chat_id,)
+                    '''WITH current_chat AS (
+                           SELECT id, operator_id FROM t_p77168343_support_chat_project.chats WHERE id = %s
+                       ), next_op AS (
+                           SELECT p.staff_id FROM t_p77168343_support_chat_project.operator_presence p, current_chat c
+                           WHERE p.status = 'online' AND p.expires_at > CURRENT_TIMESTAMP
+                             AND p.staff_id IS DISTINCT FROM c.operator_id
+                           ORDER BY RANDOM()
+                           LIMIT 1
+                       ), updated AS (
+                           UPDATE t_p77168343_support_chat_project.chats ch
+                           SET operator_id = next_op.staff_id, 
+                               timer_expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 minute'
+                           FROM next_op, current_chat c
+                           WHERE ch.id = c.id AND ch.status = ANY(%s)
+                             AND ch.operator_id IS NOT DISTINCT FROM c.operator_id
+                           RETURNING ch.id, ch.operator_id
+                       )
+                       SELECT (SELECT staff_id FROM next_op), (SELECT operator_id FROM updated)''',
+                    (chat_id, CHAT_TIMER_MINUTES, list(CHAT_TRANSITIONS['transfer']))
                 )
-                next_op = cur.fetchone()
+                next_operator_id, new_operator_id = cur.fetchone()
                 
-                if next_op:
-                    new_expires = datetime.now() + timedelta(minutes=15)
-                    cur.execute(
-                        '''UPDATE t_p77168343_support_chat_project.chats 
-                           SET operator_id = %s, timer_expires_at = %s
-                           WHERE id = %s''',
-                        (next_op[0], new_expires, chat_id)
-                    )
+                if new_operator_id is not None:
                     conn.commit()
                     cur.close()
                     conn.close()
@@ -341,10 +858,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     return {
                         'statusCode': 200,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'message': 'Chat transferred'}, ensure_ascii=False),
+                        'body': json.dumps({'message': 'Chat transferred', 'operator_id': new_operator_id}, ensure_ascii=False),
                         'isBase64Encoded': False
                     }
-                else:
+                elif next_operator_id is None:
                     cur.close()
                     conn.close()
                     return {
@@ -353,8 +870,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'body': json.dumps({'error': 'No available operators'}, ensure_ascii=False),
                         'isBase64Encoded': False
                     }
+                else:
+                    response = transition_conflict(cur, chat_id, 'transfer')
+                    cur.close()
+                    conn.close()
+                    return response
             
-            # Эскалация чата (новая резолюция)
+            # Эскалация чата (новая резолюция): переход и статистика эскалировавшего оператора - один запрос
             if body.get('resolution') == 'escalated':
                 escalate_to = body.get('escalate_to_operator_id')
                 if not escalate_to:
@@ -365,36 +887,37 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'isBase64Encoded': False
                     }
                 
-                # Получить время начала для расчета handling_time
-                cur.execute('SELECT started_at FROM t_p77168343_support_chat_project.chats WHERE id = %s', (chat_id,))
-                started_row = cur.fetchone()
-                started_at = started_row[0] if started_row else datetime.now()
-                handling_seconds = int((datetime.now() - started_at).total_seconds())
-                
-                new_expires = datetime.now() + timedelta(minutes=15)
                 cur.execute(
-                    '''UPDATE t_p77168343_support_chat_project.chats 
-                       SET operator_id = %s, 
-                           status = 'active',
-                           resolution = 'escalated',
-                           resolution_comment = %s,
-                           handling_time = %s,
-                           timer_expires_at = %s
-                       WHERE id = %s''',
-                    (escalate_to, body.get('resolution_comment', ''), handling_seconds, new_expires, chat_id)
-                )
-                conn.commit()
-                
-                # Статистика для оператора
-                cur.execute(
-                    '''INSERT INTO t_p77168343_support_chat_project.operator_chat_stats 
-                       (operator_id, date, total_chats, escalated)
-                       VALUES ((SELECT operator_id FROM t_p77168343_support_chat_project.chats WHERE id = %s), CURRENT_DATE, 1, 1)
-                       ON CONFLICT (operator_id, date) 
-                       DO UPDATE SET escalated = t_p77168343_support_chat_project.operator_chat_stats.escalated + 1,
-                                     total_chats = t_p77168343_support_chat_project.operator_chat_stats.total_chats + 1''',
-                    (chat_id,)
+                    '''WITH previous AS (
+                           SELECT id, operator_id FROM t_p77168343_support_chat_project.chats WHERE id = %s FOR UPDATE
+                       ), updated AS (
+                           UPDATE t_p77168343_support_chat_project.chats ch
+                           SET operator_id = %s, 
+                               status = 'active',
+                               resolution = 'escalated',
+                               resolution_comment = %s,
+                               handling_time = EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - COALESCE(ch.started_at, CURRENT_TIMESTAMP))::int,
+                               timer_expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 minute'
+                           FROM previous
+                           WHERE ch.id = previous.id AND ch.status = ANY(%s)
+                           RETURNING ch.id, previous.operator_id AS previous_operator_id
+                       ), stats AS (
+                           INSERT INTO t_p77168343_support_chat_project.operator_chat_stats 
+                           (operator_id, date, total_chats, escalated)
+                           SELECT previous_operator_id, CURRENT_DATE, 1, 1 FROM updated WHERE previous_operator_id IS NOT NULL
+                           ON CONFLICT (operator_id, date) 
+                           DO UPDATE SET escalated = t_p77168343_support_chat_project.operator_chat_stats.escalated + 1,
+                                         total_chats = t_p77168343_support_chat_project.operator_chat_stats.total_chats + 1
+                       )
+                       SELECT id FROM updated''',
+                    (chat_id, escalate_to, body.get('resolution_comment', ''), CHAT_TIMER_MINUTES,
+                     list(CHAT_TRANSITIONS['escalate']))
                 )
+                if not cur.fetchone():
+                    response = transition_conflict(cur, chat_id, 'escalate')
+                    cur.close()
+                    conn.close()
+                    return response
                 conn.commit()
                 cur.close()
                 conn.close()
@@ -406,56 +929,48 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            # Закрытие чата с резолюцией (resolved/postponed)
+            # Закрытие чата с резолюцией (resolved -> qc, postponed -> closed) вместе со статистикой
             if 'status' in body and body['status'] == 'closed':
                 resolution = body.get('resolution', 'resolved')
                 resolution_comment = body.get('resolution_comment', '')
                 scheduled_for = body.get('scheduled_for')
-                
-                # Получить время начала для расчета handling_time
-                cur.execute('SELECT started_at FROM t_p77168343_support_chat_project.chats WHERE id = %s', (chat_id,))
-                started_row = cur.fetchone()
-                started_at = started_row[0] if started_row else datetime.now()
-                handling_seconds = int((datetime.now() - started_at).total_seconds())
-                
-                # Определить финальный статус
                 final_status = 'qc' if resolution == 'resolved' else 'closed'
+                resolved = 1 if resolution == 'resolved' else 0
+                postponed = 1 if resolution == 'postponed' else 0
                 
                 cur.execute(
-                    '''UPDATE t_p77168343_support_chat_project.chats 
-                       SET status = %s, 
-                           closed_at = CURRENT_TIMESTAMP,
-                           resolution = %s,
-                           resolution_comment = %s,
-                           scheduled_for = %s,
-                           handling_time = %s
-                       WHERE id = %s''',
-                    (final_status, resolution, resolution_comment, scheduled_for, handling_seconds, chat_id)
-                )
-                conn.commit()
-                
-                # Обновить статистику оператора
-                cur.execute(
-                    '''INSERT INTO t_p77168343_support_chat_project.operator_chat_stats 
-                       (operator_id, date, total_chats, resolved, postponed, avg_handling_time)
-                       VALUES ((SELECT operator_id FROM t_p77168343_support_chat_project.chats WHERE id = %s), 
-                               CURRENT_DATE, 1, %s, %s, %s)
-                       ON CONFLICT (operator_id, date) 
-                       DO UPDATE SET 
-                       total_chats = t_p77168343_support_chat_project.operator_chat_stats.total_chats + 1,
-                       resolved = t_p77168343_support_chat_project.operator_chat_stats.resolved + %s,
-                       postponed = t_p77168343_support_chat_project.operator_chat_stats.postponed + %s,
-                       avg_handling_time = (t_p77168343_support_chat_project.operator_chat_stats.avg_handling_time * 
-                                           t_p77168343_support_chat_project.operator_chat_stats.total_chats + %s) / 
-                                           (t_p77168343_support_chat_project.operator_chat_stats.total_chats + 1)''',
-                    (chat_id, 
-                     1 if resolution == 'resolved' else 0,
-                     1 if resolution == 'postponed' else 0,
-                     handling_seconds,
-                     1 if resolution == 'resolved' else 0,
-                     1 if resolution == 'postponed' else 0,
-                     handling_seconds)
+                    '''WITH updated AS (
+                           UPDATE t_p77168343_support_chat_project.chats 
+                           SET status = %s, 
+                               closed_at = CURRENT_TIMESTAMP,
+                               resolution = %s,
+                               resolution_comment = %s,
+                               scheduled_for = %s,
+                               handling_time = EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - COALESCE(started_at, CURRENT_TIMESTAMP))::int
+                           WHERE id = %s AND status = ANY(%s)
+                           RETURNING id, operator_id, handling_time
+                       ), stats AS (
+                           INSERT INTO t_p77168343_support_chat_project.operator_chat_stats AS s
+                           (operator_id, date, total_chats, resolved, postponed, avg_handling_time)
+                           SELECT operator_id, CURRENT_DATE, 1, %s, %s, handling_time 
+                           FROM updated WHERE operator_id IS NOT NULL
+                           ON CONFLICT (operator_id, date) 
+                           DO UPDATE SET 
+                           total_chats = s.total_chats + 1,
+                           resolved = s.resolved + EXCLUDED.resolved,
+                           postponed = s.postponed + EXCLUDED.postponed,
+                           avg_handling_time = (s.avg_handling_time * s.total_chats + EXCLUDED.avg_handling_time) / 
+                                               (s.total_chats + 1)
+                       )
+                       SELECT id FROM updated''',
+                    (final_status, resolution, resolution_comment, scheduled_for, chat_id,
+                     list(CHAT_TRANSITIONS['close']), resolved, postponed)
                 )
+                if not cur.fetchone():
+                    response = transition_conflict(cur, chat_id, 'close')
+                    cur.close()
+                    conn.close()
+                    return response
                 conn.commit()
                 cur.close()
                 conn.close()
@@ -470,18 +985,54 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             # Обработка QC (смена статуса с 'qc' на 'processing_qc' или 'closed')
             if 'qc_status' in body:
                 qc_status = body['qc_status']
+                # Ревьюер - sub токена, без токена - reviewer_id из тела; аренда без владельца не выдаётся
+                reviewer_id = claims['sub'] if claims else body.get('reviewer_id')
+                if qc_status in ('processing_qc', 'closed') and not reviewer_id:
+                    cur.close()
+                    conn.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Reviewer is required: auth token or reviewer_id'}, ensure_ascii=False),
+                        'isBase64Encoded': False
+                    }
                 if qc_status == 'closed':
+                    # Закрыть проверку может только ревьюер, держащий аренду; свободный или брошенный чат - любой
                     cur.execute(
                         '''UPDATE t_p77168343_support_chat_project.chats 
-                           SET qc_status = %s, status = 'closed' 
-                           WHERE id = %s''',
-                        (qc_status, chat_id)
+                           SET qc_status = 'closed', status = 'closed', qc_claimed_by = %s, qc_lease_expires_at = NULL
+                           WHERE id = %s AND status = ANY(%s)
+                             AND (qc_claimed_by IS NULL OR qc_claimed_by = %s
+                                  OR qc_lease_expires_at IS NULL OR qc_lease_expires_at < CURRENT_TIMESTAMP)
+                           RETURNING id''',
+                        (reviewer_id, chat_id, list(CHAT_TRANSITIONS['qc_review']), reviewer_id)
+                    )
+                elif qc_status == 'processing_qc':
+                    # Взять чат можно, только если он свободен или аренда предыдущего ревьюера истекла
+                    cur.execute(
+                        '''UPDATE t_p77168343_support_chat_project.chats 
+                           SET qc_status = 'processing_qc', 
+                               qc_claimed_by = %s,
+                               qc_lease_expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                           WHERE id = %s AND status = ANY(%s)
+                             AND (qc_status = 'qc' OR qc_status IS NULL 
+                                  OR qc_lease_expires_at IS NULL OR qc_lease_expires_at < CURRENT_TIMESTAMP)
+                           RETURNING id''',
+                        (reviewer_id, QC_LEASE_SECONDS, chat_id, list(CHAT_TRANSITIONS['qc_review']))
                     )
                 else:
                     cur.execute(
-                        'UPDATE t_p77168343_support_chat_project.chats SET qc_status = %s WHERE id = %s',
-                        (qc_status, chat_id)
+                        '''UPDATE t_p77168343_support_chat_project.chats 
+                           SET qc_status = %s, qc_claimed_by = NULL, qc_lease_expires_at = NULL 
+                           WHERE id = %s AND status = ANY(%s)
+                           RETURNING id''',
+                        (qc_status, chat_id, list(CHAT_TRANSITIONS['qc_review']))
                     )
+                if not cur.fetchone():
+                    response = transition_conflict(cur, chat_id, 'qc_review')
+                    cur.close()
+                    conn.close()
+                    return response
                 conn.commit()
                 cur.close()
                 conn.close()
@@ -493,22 +1044,38 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
-            # Обычное обновление (оператор, статус)
+            # Обычное обновление (оператор, статус) - тоже только по разрешённым переходам
             update_fields = []
             params = []
-            
-            if 'operator_id' in body:
-                update_fields.append("operator_id = %s")
-                params.append(body['operator_id'])
+            allowed_from = list(CHAT_TRANSITIONS['reassign'])
             
             if 'status' in body:
+                if body['status'] not in STATUS_TRANSITIONS:
+                    cur.close()
+                    conn.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f"Unsupported status {body['status']}"}, ensure_ascii=False),
+                        'isBase64Encoded': False
+                    }
                 update_fields.append("status = %s")
                 params.append(body['status'])
+                allowed_from = list(STATUS_TRANSITIONS[body['status']])
+            
+            if 'operator_id' in body:
+                update_fields.append("operator_id = %s")
+                params.append(body['operator_id'])
             
             if update_fields:
-                params.append(chat_id)
-                query = f"UPDATE t_p77168343_support_chat_project.chats SET {', '.join(update_fields)} WHERE id = %s"
+                params.extend([chat_id, allowed_from])
+                query = f"UPDATE t_p77168343_support_chat_project.chats SET {', '.join(update_fields)} WHERE id = %s AND status = ANY(%s) RETURNING id"
                 cur.execute(query, tuple(params))
+                if not cur.fetchone():
+                    response = transition_conflict(cur, chat_id, 'update')
+                    cur.close()
+                    conn.close()
+                    return response
                 conn.commit()
             
             cur.close()
@@ -542,4 +1109,133 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'body': json.dumps({'error': str(e)}, ensure_ascii=False),
             'isBase64Encoded': False
-        }
\ No newline at end of file
+        }
+
+
+if __name__ == '__main__' and sys.argv[1:2] == ['transitions']:
+    # Гонка охраняемых переходов: на один чат параллельно летят закрытия, эскалации, передачи и продления,
+    # затем взятие в QC и завершение QC, затем переоткрытие. Проверяется, что переход из каждого состояния
+    # выигрывает ровно один запрос (остальные - 409), а operator_chat_stats и timer_extended сходятся
+    # с числом выигравших. Нужны DATABASE_URL тестовой базы и хотя бы один сотрудник в staff;
+    # python index.py transitions [раундов] [запросов каждого вида]
+    from concurrent.futures import ThreadPoolExecutor
+    
+    ROUNDS = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    PER_KIND = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    STATS_SQL = '''SELECT COALESCE(SUM(total_chats), 0), COALESCE(SUM(resolved), 0), COALESCE(SUM(escalated), 0),
+                        COALESCE(SUM(transferred_chats), 0)
+                 FROM t_p77168343_support_chat_project.operator_chat_stats WHERE date = CURRENT_DATE'''
+    
+    def query(sql: str, params: tuple = ()) -> list:
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        try:
+            cur = conn.cursor()
+            cur.execute(sql, params)
+            rows = cur.fetchall() if cur.description else []
+            conn.commit()
+            return rows
+        finally:
+            conn.close()
+    
+    def put(body: Dict[str, Any]) -> int:
+        return handle_request({'httpMethod': 'PUT', 'headers': {}, 'body': json.dumps(body)}, None)['statusCode']
+    
+    def race(bodies: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, List[int]]:
+        with ThreadPoolExecutor(len(bodies)) as pool:
+            codes = list(pool.map(lambda item: put(item[1]), bodies))
+        outcome: Dict[str, List[int]] = {}
+        for (kind, _), code in zip(bodies, codes):
+            outcome.setdefault(kind, []).append(code)
+        return outcome
+    
+    def expect(condition: bool, message: str) -> None:
+        if not condition:
+            raise SystemExit(f'FAILED: {message}')
+    
+    staff_ids = [row[0] for row in query('SELECT id FROM t_p77168343_support_chat_project.staff ORDER BY id LIMIT %s',
+                                           (PER_KIND,))]
+    expect(bool(staff_ids), 'staff table is empty')
+    totals: Dict[str, int] = {}
+    
+    for round_no in range(ROUNDS):
+        created = handle_request({'httpMethod': 'POST', 'headers': {}, 'body': json.dumps({
+            'client_name': 'Stress', 'client_phone': '+70000000000',
+            'session_id': f'stress-{os.getpid()}-{round_no}', 'message': 'race'
+        })}, None)
+        expect(created['statusCode'] == 201, f'create chat: {created["body"]}')
+        chat_id = json.loads(created['body'])['id']
+        query('UPDATE t_p77168343_support_chat_project.chats SET operator_id = %s WHERE id = %s', (staff_ids[0], chat_id))
+        before = query(STATS_SQL)[0]
+        
+        # active: закрытие выигрывает одно; эскалации, передачи и продления проходят, только пока чат active
+        outcome = race(
+            [('close', {'id': chat_id, 'status': 'closed', 'resolution': 'resolved'})] * PER_KIND
+            + [('escalate', {'id': chat_id, 'resolution': 'escalated', 'escalate_to_operator_id': staff_ids[-1]})] * PER_KIND
+            + [('transfer', {'id': chat_id, 'transfer_to_next': True})] * PER_KIND
+            + [('extend', {'id': chat_id, 'extend_timer': True})] * PER_KIND
+        )
+        wins = {kind: codes.count(200) for kind, codes in outcome.items()}
+        expect(wins['close'] == 1, f'chat {chat_id}: {wins["close"]} closes won')
+        for kind, codes in outcome.items():
+            # Передача без другого оператора на линии - 400 No available operators
+            allowed = {200, 409} | ({400} if kind == 'transfer' else set())
+            expect(set(codes) <= allowed, f'chat {chat_id}: unexpected {kind} codes {sorted(set(codes))}')
+        
+        status, timer_extended = query('''SELECT status, timer_extended FROM t_p77168343_support_chat_project.chats 
+                                          WHERE id = %s''', (chat_id,))[0]
+        after = query(STATS_SQL)[0]
+        delta = [int(a) - int(b) for a, b in zip(after, before)]
+        expect(status == 'qc', f'chat {chat_id}: status {status} after close')
+        expect(timer_extended == wins['extend'], f'chat {chat_id}: timer_extended {timer_extended}, extends won {wins["extend"]}')
+        # Одиночная передача (transfer_to_next) не пишет transferred_chats - его ведёт только массовая передача
+        expect(delta == [1 + wins['escalate'], 1, wins['escalate'], 0],
+               f'chat {chat_id}: stats delta {delta} for wins {wins}')
+        
+        # qc: взять в работу может один ревьюер, завершить - только он
+        claim = race([('claim', {'id': chat_id, 'qc_status': 'processing_qc', 'reviewer_id': reviewer})
+                      for reviewer in staff_ids])
+        expect(sorted(claim['claim']) == [200] + [409] * (len(staff_ids) - 1), f'chat {chat_id}: QC claims {claim["claim"]}')
+        holder = query('SELECT qc_claimed_by FROM t_p77168343_support_chat_project.chats WHERE id = %s', (chat_id,))[0][0]
+        finish = race([('finish', {'id': chat_id, 'qc_status': 'closed', 'reviewer_id': reviewer}) for reviewer in staff_ids])
+        expect(sorted(finish['finish']) == [200] + [409] * (len(staff_ids) - 1), f'chat {chat_id}: QC finishes {finish["finish"]}')
+        closed_by = query('SELECT qc_claimed_by FROM t_p77168343_support_chat_project.chats WHERE id = %s', (chat_id,))[0][0]
+        expect(closed_by == holder, f'chat {chat_id}: QC claimed by {holder}, closed by {closed_by}')
+        
+        # closed: переоткрытие выигрывает одно
+        reopen = race([('reopen', {'id': chat_id, 'status': 'active'})] * PER_KIND)
+        expect(sorted(reopen['reopen']) == [200] + [409] * (PER_KIND - 1), f'chat {chat_id}: reopens {reopen["reopen"]}')
+        put({'id': chat_id, 'status': 'closed', 'resolution': 'resolved'})
+        
+        for kind, count in wins.items():
+            totals[kind] = totals.get(kind, 0) + count
+    
+    print(f'{ROUNDS} rounds x {PER_KIND} requests of each kind: all transitions consistent; '
+          f'wins {json.dumps(totals)}')
+
+
+elif __name__ == '__main__':
+    # Замер сводки GET ?overview=1: последовательные чтения psycopg2 против конвейера psycopg 3.
+    # Нужен DATABASE_URL; python index.py [число запросов]
+    ROUNDS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    event = {'httpMethod': 'GET', 'headers': {}, 'queryStringParameters': {'overview': '1'}}
+    
+    def measure(use_async: bool) -> List[float]:
+        global DB_ASYNC
+        DB_ASYNC = use_async
+        handle_request(event, None)
+        latencies = []
+        for _ in range(ROUNDS):
+            started = time.perf_counter()
+            response = handle_request(event, None)
+            latencies.append(time.perf_counter() - started)
+            if response['statusCode'] != 200:
+                raise SystemExit(response['body'])
+        return sorted(latencies)
+    
+    modes = [('sequential', False)] + ([('pipelined', True)] if load_async_modules() else [])
+    if len(modes) == 1:
+        print('psycopg 3 / psycopg_pool not installed: only the sequential path is measured')
+    for label, use_async in modes:
+        latencies = measure(use_async)
+        print(f'{label:<11} p50 {latencies[len(latencies) // 2] * 1000:6.1f} ms, '
+              f'p95 {latencies[int(len(latencies) * 0.95)] * 1000:6.1f} ms over {ROUNDS} requests')
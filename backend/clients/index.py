@@ -0,0 +1,159 @@
+'''
+Business: API клиентов - постраничный список, поиск по префиксу телефона и имени, карточка клиента
+Args: event - dict с httpMethod, queryStringParameters, headers
+      context - объект с атрибутами request_id, function_name
+Returns: HTTP response dict со списком клиентов (курсор следующей страницы в X-Next-Cursor)
+'''
+import json
+import os
+import sys
+import psycopg2
+from typing import Dict, Any
+
+# Общий код функций (backend/shared) лежит каталогом выше index.py
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+from shared.auth_tokens import verify_auth_token
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def client_to_dict(row) -> Dict[str, Any]:
+    return {
+        'id': str(row[0]),
+        'name': row[1],
+        'phone': row[2],
+        'email': row[3],
+        'session_id': row[4],
+        'first_contact_at': row[5].isoformat() if row[5] else None,
+        'last_contact_at': row[6].isoformat() if row[6] else None,
+        'total_chats': row[7]
+    }
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Expose-Headers': 'X-Next-Cursor',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    if method != 'GET':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    
+    try:
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cur = conn.cursor()
+        
+        claims, auth_error = verify_auth_token(event, cur)
+        if auth_error:
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': auth_error}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        params = event.get('queryStringParameters', {}) or {}
+        client_id = params.get('id')
+        columns = '''id, name, phone, email, session_id, first_interaction, last_interaction, total_chats'''
+        next_cursor = None
+        
+        # Карточка одного клиента
+        if client_id:
+            cur.execute(
+                f'SELECT {columns} FROM t_p77168343_support_chat_project.clients WHERE id = %s',
+                (client_id,)
+            )
+            row = cur.fetchone()
+            result = client_to_dict(row) if row else None
+        
+        # Поиск по префиксу: цифры - по нормализованному телефону, иначе по имени
+        elif params.get('q'):
+            query_text = params['q'].strip()
+            limit = min(int(params.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+            digits = ''.join(ch for ch in query_text if ch.isdigit())
+            if digits and not any(ch.isalpha() for ch in query_text):
+                cur.execute(
+                    f'''SELECT {columns} FROM t_p77168343_support_chat_project.clients 
+                        WHERE phone_normalized LIKE %s 
+                        ORDER BY phone_normalized LIMIT %s''',
+                    (escape_like(digits) + '%', limit)
+                )
+            else:
+                cur.execute(
+                    f'''SELECT {columns} FROM t_p77168343_support_chat_project.clients 
+                        WHERE lower(name) LIKE %s 
+                        ORDER BY lower(name) LIMIT %s''',
+                    (escape_like(query_text.lower()) + '%', limit)
+                )
+            result = [client_to_dict(row) for row in cur.fetchall()]
+        
+        # Постраничный список по последнему обращению (keyset: last_interaction, id)
+        else:
+            limit = min(int(params.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+            cursor = params.get('cursor')
+            if cursor:
+                cursor_ts, cursor_id = cursor.split('|', 1)
+                cur.execute(
+                    f'''SELECT {columns} FROM t_p77168343_support_chat_project.clients 
+                        WHERE (last_interaction, id) < (%s, %s::uuid)
+                        ORDER BY last_interaction DESC, id DESC LIMIT %s''',
+                    (cursor_ts, cursor_id, limit)
+                )
+            else:
+                cur.execute(
+                    f'''SELECT {columns} FROM t_p77168343_support_chat_project.clients 
+                        ORDER BY last_interaction DESC, id DESC LIMIT %s''',
+                    (limit,)
+                )
+            rows = cur.fetchall()
+            result = [client_to_dict(row) for row in rows]
+            if len(rows) == limit:
+                next_cursor = f'{rows[-1][6].isoformat()}|{rows[-1][0]}'
+        
+        cur.close()
+        conn.close()
+        
+        headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+        if next_cursor:
+            headers['X-Next-Cursor'] = next_cursor
+            headers['Access-Control-Expose-Headers'] = 'X-Next-Cursor'
+        
+        return {
+            'statusCode': 200,
+            'headers': headers,
+            'body': json.dumps(result, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
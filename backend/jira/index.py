@@ -0,0 +1,390 @@
+'''
+Business: API задач Jira - очередь с фильтрами и постраничной выдачей по приоритету и сроку, массовая смена статуса, счётчики открытых задач по исполнителю
+Args: event - dict с httpMethod, body, queryStringParameters, headers
+      context - объект с атрибутами request_id, function_name
+Returns: HTTP response dict с задачами (курсор следующей страницы в X-Next-Cursor) или результатом изменения
+'''
+import json
+import os
+import sys
+import psycopg2
+from typing import Dict, Any, List, Optional
+
+# Общий код функций (backend/shared) лежит каталогом выше index.py
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+from shared.auth_tokens import verify_auth_token
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_BULK_TASKS = 200
+TASK_STATUSES = ('new', 'in_progress', 'done', 'cancelled')
+OPEN_STATUSES = ('new', 'in_progress')
+TASK_PRIORITIES = ('low', 'medium', 'high', 'critical')
+
+# Порядок выдачи -> (ORDER BY, ключ keyset-курсора). priority - открытые задачи по приоритету, затем сроку
+# (без срока - в конце), recent - по последнему изменению; оба покрыты индексами из V0026
+TASK_SORTS = {
+    'priority': (
+        "t.priority_rank, COALESCE(t.due_date, 'infinity'::timestamp), t.id",
+        "(t.priority_rank, COALESCE(t.due_date, 'infinity'::timestamp), t.id) > (%s, %s::timestamp, %s)"
+    ),
+    'recent': (
+        't.updated_at DESC, t.id DESC',
+        '(t.updated_at, t.id) < (%s::timestamp, %s)'
+    ),
+}
+
+TASK_SELECT = '''SELECT t.id, t.title, t.description, t.priority, t.status, t.created_by, creator.name,
+                        t.assigned_to, assignee.name, t.created_at, t.updated_at, t.due_date, 
+                        t.resolution_comment, t.priority_rank
+                 FROM t_p77168343_support_chat_project.jira_tasks t
+                 LEFT JOIN t_p77168343_support_chat_project.staff creator ON creator.id = t.created_by
+                 LEFT JOIN t_p77168343_support_chat_project.staff assignee ON assignee.id = t.assigned_to'''
+
+
+def task_to_dict(row) -> Dict[str, Any]:
+    return {
+        'id': row[0],
+        'title': row[1],
+        'description': row[2],
+        'priority': row[3],
+        'status': row[4],
+        'created_by': row[5],
+        'creator_name': row[6],
+        'assigned_to': row[7],
+        'assignee_name': row[8],
+        'created_at': row[9].isoformat() if row[9] else None,
+        'updated_at': row[10].isoformat() if row[10] else None,
+        'due_date': row[11].isoformat() if row[11] else None,
+        'resolution_comment': row[12]
+    }
+
+
+def task_cursor(row, sort: str) -> str:
+    if sort == 'priority':
+        return f"{row[13]}|{row[11].isoformat() if row[11] else 'infinity'}|{row[0]}"
+    return f'{row[10].isoformat()}|{row[0]}'
+
+
+def can_process(claims: Optional[Dict[str, Any]]) -> bool:
+    '''Массовая обработка очереди - суперадмин и ОКК, как и в интерфейсе'''
+    if not claims:
+        return False
+    return claims.get('role') in ('superadmin', 'okk')
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Expose-Headers': 'X-Next-Cursor',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    try:
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cur = conn.cursor()
+        
+        claims, auth_error = verify_auth_token(event, cur)
+        if auth_error:
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': auth_error}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        params = event.get('queryStringParameters', {}) or {}
+        
+        if method == 'GET':
+            next_cursor = None
+            
+            # Счётчики открытых задач - чтение по первичному ключу вместо COUNT по задачам
+            if params.get('counts'):
+                if params.get('assigned_to'):
+                    cur.execute(
+                        '''SELECT open_count FROM t_p77168343_support_chat_project.jira_task_counters 
+                           WHERE assignee_id = %s''',
+                        (int(params['assigned_to']),)
+                    )
+                    row = cur.fetchone()
+                    result = {'assigned_to': int(params['assigned_to']), 'open_count': row[0] if row else 0}
+                else:
+                    cur.execute(
+                        '''SELECT assignee_id, open_count FROM t_p77168343_support_chat_project.jira_task_counters 
+                           WHERE open_count <> 0'''
+                    )
+                    counts = {row[0]: row[1] for row in cur.fetchall()}
+                    result = {
+                        'unassigned': counts.pop(0, 0),
+                        'by_assignee': {str(assignee_id): count for assignee_id, count in counts.items()}
+                    }
+            
+            elif params.get('id'):
+                cur.execute(f'{TASK_SELECT} WHERE t.id = %s', (int(params['id']),))
+                row = cur.fetchone()
+                if row is None:
+                    cur.close()
+                    conn.close()
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Task not found'}, ensure_ascii=False),
+                        'isBase64Encoded': False
+                    }
+                result = task_to_dict(row)
+            
+            # Очередь: фильтры по исполнителю, статусам и приоритету, keyset-курсор по выбранному порядку
+            else:
+                statuses = [s for s in (params.get('status') or '').split(',') if s]
+                if statuses == ['open']:
+                    statuses = list(OPEN_STATUSES)
+                if any(s not in TASK_STATUSES for s in statuses):
+                    cur.close()
+                    conn.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Unknown status'}, ensure_ascii=False),
+                        'isBase64Encoded': False
+                    }
+                default_sort = 'priority' if statuses and set(statuses) <= set(OPEN_STATUSES) else 'recent'
+                sort = params.get('sort') or default_sort
+                if sort not in TASK_SORTS:
+                    cur.close()
+                    conn.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Unknown sort'}, ensure_ascii=False),
+                        'isBase64Encoded': False
+                    }
+                limit = min(int(params.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+                
+                conditions: List[str] = []
+                query_params: List[Any] = []
+                if statuses:
+                    # Для открытых статусов условие совпадает с предикатом частичных индексов
+                    if set(statuses) == set(OPEN_STATUSES):
+                        conditions.append("t.status IN ('new', 'in_progress')")
+                    else:
+                        conditions.append('t.status = ANY(%s)')
+                        query_params.append(statuses)
+                if params.get('assigned_to') == 'none':
+                    conditions.append('t.assigned_to IS NULL')
+                elif params.get('assigned_to'):
+                    conditions.append('t.assigned_to = %s')
+                    query_params.append(int(params['assigned_to']))
+                if params.get('priority'):
+                    conditions.append('t.priority = %s')
+                    query_params.append(params['priority'])
+                order_by, keyset = TASK_SORTS[sort]
+                if params.get('cursor'):
+                    conditions.append(keyset)
+                    query_params.extend(params['cursor'].split('|'))
+                query_params.append(limit)
+                
+                cur.execute(
+                    f'''{TASK_SELECT} 
+                        {'WHERE ' + ' AND '.join(conditions) if conditions else ''} 
+                        ORDER BY {order_by} LIMIT %s''',
+                    tuple(query_params)
+                )
+                rows = cur.fetchall()
+                result = [task_to_dict(row) for row in rows]
+                if len(rows) == limit:
+                    next_cursor = task_cursor(rows[-1], sort)
+            
+            cur.close()
+            conn.close()
+            
+            headers = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+            if next_cursor:
+                headers['X-Next-Cursor'] = next_cursor
+                headers['Access-Control-Expose-Headers'] = 'X-Next-Cursor'
+            
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps(result, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        elif method == 'POST':
+            body = json.loads(event.get('body', '{}'))
+            priority = body.get('priority') or 'medium'
+            if not body.get('title') or priority not in TASK_PRIORITIES:
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Missing required fields'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            cur.execute(
+                '''INSERT INTO t_p77168343_support_chat_project.jira_tasks 
+                   (title, description, priority, status, created_by, assigned_to, due_date)
+                   VALUES (%s, %s, %s, 'new', %s, %s, %s) 
+                   RETURNING id''',
+                (body['title'], body.get('description'), priority,
+                 body.get('created_by') or (claims or {}).get('sub'), body.get('assigned_to'), body.get('due_date') or None)
+            )
+            task_id = cur.fetchone()[0]
+            cur.execute(f'{TASK_SELECT} WHERE t.id = %s', (task_id,))
+            result = task_to_dict(cur.fetchone())
+            conn.commit()
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 201,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps(result, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        elif method == 'PUT':
+            body = json.loads(event.get('body', '{}'))
+            status = body.get('status')
+            if status is not None and status not in TASK_STATUSES:
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Unknown status'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            if body.get('priority') is not None and body['priority'] not in TASK_PRIORITIES:
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Unknown priority'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            
+            # Массовая смена статуса (и, при необходимости, исполнителя) одним UPDATE; счётчики
+            # обновляет триггер уровня оператора одной записью на исполнителя
+            if 'ids' in body:
+                task_ids = [int(task_id) for task_id in body.get('ids') or []]
+                if not task_ids or len(task_ids) > MAX_BULK_TASKS or status is None:
+                    cur.close()
+                    conn.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f'ids (up to {MAX_BULK_TASKS}) and status are required'}, ensure_ascii=False),
+                        'isBase64Encoded': False
+                    }
+                if not can_process(claims):
+                    cur.close()
+                    conn.close()
+                    return {
+                        'statusCode': 403 if claims else 401,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Forbidden' if claims else 'Auth token required'}, ensure_ascii=False),
+                        'isBase64Encoded': False
+                    }
+                cur.execute(
+                    '''UPDATE t_p77168343_support_chat_project.jira_tasks 
+                       SET status = %s,
+                           assigned_to = CASE WHEN %s THEN %s ELSE assigned_to END,
+                           resolution_comment = COALESCE(%s, resolution_comment),
+                           updated_at = CURRENT_TIMESTAMP
+                       WHERE id = ANY(%s) AND status <> %s
+                       RETURNING id''',
+                    (status, 'assigned_to' in body, body.get('assigned_to'), body.get('resolution_comment'),
+                     task_ids, status)
+                )
+                updated = sorted(row[0] for row in cur.fetchall())
+                conn.commit()
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'updated': updated,
+                        'skipped': sorted(set(task_ids) - set(updated))
+                    }, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            
+            if not body.get('id'):
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Task id is required'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            cur.execute(
+                '''UPDATE t_p77168343_support_chat_project.jira_tasks 
+                   SET title = COALESCE(%s, title),
+                       description = COALESCE(%s, description),
+                       priority = COALESCE(%s, priority),
+                       status = COALESCE(%s, status),
+                       assigned_to = CASE WHEN %s THEN %s ELSE assigned_to END,
+                       due_date = CASE WHEN %s THEN %s ELSE due_date END,
+                       resolution_comment = COALESCE(%s, resolution_comment),
+                       updated_at = CURRENT_TIMESTAMP
+                   WHERE id = %s
+                   RETURNING id''',
+                (body.get('title'), body.get('description'), body.get('priority'), status,
+                 'assigned_to' in body, body.get('assigned_to'), 'due_date' in body, body.get('due_date') or None,
+                 body.get('resolution_comment'), int(body['id']))
+            )
+            if cur.fetchone() is None:
+                conn.rollback()
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Task not found'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            cur.execute(f'{TASK_SELECT} WHERE t.id = %s', (int(body['id']),))
+            result = task_to_dict(cur.fetchone())
+            conn.commit()
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps(result, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        cur.close()
+        conn.close()
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
@@ -0,0 +1,405 @@
+'''
+Business: API базы знаний - статьи с фильтром по категории и тегам, ранжированный полнотекстовый поиск, популярные статьи, учёт просмотров с отложенной записью
+Args: event - dict с httpMethod, body, queryStringParameters, headers
+      context - объект с атрибутами request_id, function_name
+Returns: HTTP response dict со статьями или результатом изменения
+'''
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+import psycopg2
+from typing import Dict, Any, List, Optional
+
+# Общий код функций (backend/shared) лежит каталогом выше index.py
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+from shared.auth_tokens import verify_auth_token
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+SEARCH_CONFIG = 'russian'
+
+# Популярные статьи целиком держатся в памяти тёплого экземпляра; правка статьи сбрасывает кеш
+HOT_ARTICLES_LIMIT = 20
+HOT_CACHE_SECONDS = 60
+
+# Просмотры копятся в памяти и записываются одним UPDATE на пачку статей, а не строкой на каждое чтение.
+# При остановке экземпляра теряется не больше одного интервала сброса
+VIEW_FLUSH_INTERVAL_SECONDS = int(os.environ.get('KB_VIEW_FLUSH_SECONDS', '30'))
+VIEW_FLUSH_MAX_PENDING = 500
+
+ARTICLE_COLUMNS = '''id, category, title, content, tags, author_id, author_name, views_count, 
+                     is_published, created_at, updated_at'''
+
+_hot_cache: Dict[str, Any] = {'articles': [], 'by_id': {}, 'loaded_at': 0.0}
+_pending_views: Dict[str, int] = {}
+_views_lock = threading.Lock()
+_views_flushed_at = [time.time()]
+
+
+def article_to_dict(row) -> Dict[str, Any]:
+    return {
+        'id': str(row[0]),
+        'category': row[1],
+        'title': row[2],
+        'content': row[3],
+        'tags': row[4] or [],
+        'author_id': row[5],
+        'author_name': row[6],
+        'views_count': (row[7] or 0) + _pending_views.get(str(row[0]), 0),
+        'is_published': row[8],
+        'created_at': row[9].isoformat() if row[9] else None,
+        'updated_at': row[10].isoformat() if row[10] else None
+    }
+
+
+def record_view(article_id: str) -> None:
+    with _views_lock:
+        _pending_views[article_id] = _pending_views.get(article_id, 0) + 1
+
+
+def views_flush_due() -> bool:
+    return bool(_pending_views) and (
+        time.time() - _views_flushed_at[0] >= VIEW_FLUSH_INTERVAL_SECONDS
+        or len(_pending_views) >= VIEW_FLUSH_MAX_PENDING
+    )
+
+
+def flush_views(cur) -> int:
+    '''Записывает накопленные просмотры одним UPDATE; при ошибке счётчики возвращаются в буфер'''
+    with _views_lock:
+        batch = dict(_pending_views)
+        _pending_views.clear()
+        _views_flushed_at[0] = time.time()
+    if not batch:
+        return 0
+    # Порядок по id одинаков во всех экземплярах, поэтому параллельные сбросы не взаимоблокируются
+    article_ids = sorted(batch)
+    try:
+        cur.execute(
+            '''UPDATE t_p77168343_support_chat_project.knowledge_base AS kb 
+               SET views_count = COALESCE(kb.views_count, 0) + v.views 
+               FROM (SELECT unnest(%s::uuid[]) AS id, unnest(%s::int[]) AS views) v 
+               WHERE kb.id = v.id''',
+            (article_ids, [batch[article_id] for article_id in article_ids])
+        )
+    except Exception:
+        with _views_lock:
+            for article_id, views in batch.items():
+                _pending_views[article_id] = _pending_views.get(article_id, 0) + views
+        raise
+    return len(article_ids)
+
+
+def get_hot_articles(cur) -> List[Dict[str, Any]]:
+    if time.time() - _hot_cache['loaded_at'] > HOT_CACHE_SECONDS:
+        cur.execute(
+            f'''SELECT {ARTICLE_COLUMNS} FROM t_p77168343_support_chat_project.knowledge_base 
+                WHERE is_published = true 
+                ORDER BY views_count DESC NULLS LAST LIMIT %s''',
+            (HOT_ARTICLES_LIMIT,)
+        )
+        rows = cur.fetchall()
+        _hot_cache['by_id'] = {str(row[0]): row for row in rows}
+        _hot_cache['articles'] = [str(row[0]) for row in rows]
+        _hot_cache['loaded_at'] = time.time()
+    return [article_to_dict(_hot_cache['by_id'][article_id]) for article_id in _hot_cache['articles']]
+
+
+def invalidate_hot_cache() -> None:
+    _hot_cache['loaded_at'] = 0.0
+
+
+def parse_article_id(value: Any) -> Optional[str]:
+    '''Канонический UUID статьи или None: битый id не должен доходить до запроса и падать в нём 500'''
+    try:
+        return str(uuid.UUID(str(value or '')))
+    except ValueError:
+        return None
+
+
+def can_edit(claims: Optional[Dict[str, Any]]) -> bool:
+    if not claims:
+        return False
+    return claims.get('role') in ('superadmin', 'editor') or bool(claims.get('perms', {}).get('knowledge', {}).get('edit'))
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    params = event.get('queryStringParameters', {}) or {}
+    
+    # Просмотр статьи: только счётчик в памяти, в БД - когда подойдёт время сброса
+    if method == 'POST' and params.get('action') == 'view':
+        article_id = parse_article_id(params.get('id'))
+        if article_id is None:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Valid article id is required'}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        record_view(article_id)
+        flushed = 0
+        if views_flush_due():
+            try:
+                conn = psycopg2.connect(os.environ['DATABASE_URL'])
+                cur = conn.cursor()
+                flushed = flush_views(cur)
+                conn.commit()
+                cur.close()
+                conn.close()
+            except Exception as e:
+                print(f"View flush failed, will retry: {e}")
+        return {
+            'statusCode': 202,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'recorded': True, 'flushed_articles': flushed}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    
+    try:
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cur = conn.cursor()
+        
+        claims, auth_error = verify_auth_token(event, cur)
+        if auth_error:
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': auth_error}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        # Запрос уже держит соединение - заодно сбрасываем накопленные просмотры, если пора
+        if views_flush_due():
+            try:
+                flush_views(cur)
+                conn.commit()
+            except psycopg2.Error as e:
+                conn.rollback()
+                print(f"View flush failed, will retry: {e}")
+        
+        if method == 'GET':
+            article_id = params.get('id')
+            limit = min(int(params.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+            
+            # Популярные статьи из кеша экземпляра
+            if params.get('hot'):
+                result = get_hot_articles(cur)[:limit]
+            
+            # Одна статья: популярные отдаются из кеша без запроса; черновик видит только тот, кто может править
+            elif article_id:
+                article_id = parse_article_id(article_id)
+                if article_id is None:
+                    cur.close()
+                    conn.close()
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Valid article id is required'}, ensure_ascii=False),
+                        'isBase64Encoded': False
+                    }
+                row = _hot_cache['by_id'].get(article_id) if time.time() - _hot_cache['loaded_at'] <= HOT_CACHE_SECONDS else None
+                if row is None:
+                    cur.execute(
+                        f'''SELECT {ARTICLE_COLUMNS} FROM t_p77168343_support_chat_project.knowledge_base 
+                            WHERE id = %s AND (is_published = true OR %s)''',
+                        (article_id, can_edit(claims))
+                    )
+                    row = cur.fetchone()
+                if row is None:
+                    cur.close()
+                    conn.close()
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Article not found'}, ensure_ascii=False),
+                        'isBase64Encoded': False
+                    }
+                result = article_to_dict(row)
+            
+            # Список и поиск: категория - по индексу category, теги - containment по GIN-индексу tags,
+            # текст - websearch-запрос по search_vector с ранжированием (заголовок весомее содержимого)
+            else:
+                conditions = ['is_published = true']
+                query_params: List[Any] = []
+                if params.get('category'):
+                    conditions.append('category = %s')
+                    query_params.append(params['category'])
+                tags = [tag.strip() for tag in (params.get('tags') or '').split(',') if tag.strip()]
+                if tags:
+                    conditions.append('tags @> %s::text[]')
+                    query_params.append(tags)
+                search = (params.get('q') or '').strip()
+                if search:
+                    conditions.append(f"search_vector @@ websearch_to_tsquery('{SEARCH_CONFIG}', %s)")
+                    query_params.append(search)
+                    order = f"ts_rank_cd(search_vector, websearch_to_tsquery('{SEARCH_CONFIG}', %s)) DESC, updated_at DESC"
+                    query_params.append(search)
+                else:
+                    order = 'updated_at DESC'
+                query_params.append(limit)
+                cur.execute(
+                    f'''SELECT {ARTICLE_COLUMNS} FROM t_p77168343_support_chat_project.knowledge_base 
+                        WHERE {' AND '.join(conditions)} 
+                        ORDER BY {order} LIMIT %s''',
+                    tuple(query_params)
+                )
+                result = [article_to_dict(row) for row in cur.fetchall()]
+            
+            cur.close()
+            conn.close()
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps(result, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        if method not in ('POST', 'PUT', 'DELETE'):
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 405,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Method not allowed'}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        # Править базу знаний могут редактор, суперадмин или роль с правом knowledge.edit; без токена - никто
+        if not can_edit(claims):
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 403 if claims else 401,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Forbidden' if claims else 'Auth token required'}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        if method == 'DELETE':
+            article_id = parse_article_id(params.get('id'))
+            if article_id is None:
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Valid article id is required'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            cur.execute(
+                'DELETE FROM t_p77168343_support_chat_project.knowledge_base WHERE id = %s RETURNING id',
+                (article_id,)
+            )
+            deleted = cur.fetchone()
+            conn.commit()
+            cur.close()
+            conn.close()
+            invalidate_hot_cache()
+            
+            return {
+                'statusCode': 200 if deleted else 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'message': 'Article deleted'} if deleted else {'error': 'Article not found'}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        body = json.loads(event.get('body', '{}'))
+        tags = [str(tag).strip() for tag in body.get('tags') or [] if str(tag).strip()]
+        
+        if method == 'POST':
+            if not all([body.get('title'), body.get('content'), body.get('category')]):
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Missing required fields'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            cur.execute(
+                f'''INSERT INTO t_p77168343_support_chat_project.knowledge_base 
+                    (category, title, content, tags, author_id, author_name, is_published)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    RETURNING {ARTICLE_COLUMNS}''',
+                (body['category'], body['title'], body['content'], tags,
+                 body.get('author_id') or (claims or {}).get('sub') or 0, body.get('author_name'),
+                 body.get('is_published', True))
+            )
+            status_code = 201
+        else:
+            article_id = parse_article_id(body.get('id'))
+            if article_id is None:
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Valid article id is required'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            cur.execute(
+                f'''UPDATE t_p77168343_support_chat_project.knowledge_base 
+                    SET category = COALESCE(%s, category),
+                        title = COALESCE(%s, title),
+                        content = COALESCE(%s, content),
+                        tags = COALESCE(%s, tags),
+                        is_published = COALESCE(%s, is_published),
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                    RETURNING {ARTICLE_COLUMNS}''',
+                (body.get('category'), body.get('title'), body.get('content'),
+                 tags if 'tags' in body else None, body.get('is_published'), article_id)
+            )
+            status_code = 200
+        
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
+        conn.close()
+        invalidate_hot_cache()
+        
+        if row is None:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Article not found'}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        return {
+            'statusCode': status_code,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(article_to_dict(row), ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
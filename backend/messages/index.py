@@ -1,15 +1,131 @@
 '''
-Business: API для работы с сообщениями в чатах - получение и добавление сообщений
+Business: API для работы с сообщениями в чатах - получение и добавление сообщений, сигналы набора текста и прочтения
 Args: event - dict с httpMethod, body, queryStringParameters
       context - объект с атрибутами request_id, function_name
 Returns: HTTP response dict с данными сообщений
 '''
 import json
 import os
+import sys
+import time
 import psycopg2
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
+
+# Общий код функций (backend/shared) лежит каталогом выше index.py
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+from shared.admission import handle_admitted
+from shared.auth_tokens import verify_auth_token
+from shared.idempotency import claim_idempotency_key, store_idempotent_response
+from shared.replica import WalTrackingConnection, connect_for_read, with_wal_position
+
+# Эфемерные сигналы (печатает / прочитано) в UNLOGGED-таблице chat_signals: одна строка на участника чата,
+# повторные сигналы схлопываются условием в upsert. Отдаются в том же опросе, что и сообщения (?signals=1).
+# Таблица не реплицируется, поэтому сигналы читаются и пишутся только на первичном сервере
+TYPING_TTL_SECONDS = 6
+# Повторный "печатает" продлевает строку, только если до истечения осталось меньше половины TTL
+TYPING_REFRESH_SECONDS = TYPING_TTL_SECONDS / 2
+SIGNAL_TYPES = ('typing', 'stop_typing', 'read')
+TYPING_THROTTLE_LIMIT = 10000
+
+# Когда этот экземпляр последний раз продлил "печатает" участника: повтор раньше TYPING_REFRESH_SECONDS
+# ничего не изменил бы в БД, поэтому отвечается без соединения. Ключ - чат и участник, чью строку продлили
+_typing_written: Dict[Tuple[str, str, str], float] = {}
+
+
+def signal_participant_id(signal: Dict[str, Any], claims: Optional[Dict[str, Any]]) -> str:
+    '''Оператор с токеном - всегда sub токена, а не id из тела; клиент - participant_id из тела'''
+    if claims and signal.get('participant_type') == 'operator':
+        return str(claims['sub'])
+    return str(signal.get('participant_id') or (claims or {}).get('sub') or '')
+
+
+def typing_throttle_key(signal: Dict[str, Any], participant_id: Any) -> Optional[Tuple[str, str, str]]:
+    if not signal.get('chat_id') or not participant_id:
+        return None
+    return (str(signal['chat_id']), str(signal.get('participant_type')), str(participant_id))
+
+
+def parse_signal(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if event.get('httpMethod') != 'POST':
+        return None
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) and body.get('signal') else None
+
+
+def apply_signal(cur, body: Dict[str, Any], claims: Optional[Dict[str, Any]]) -> bool:
+    '''Записывает сигнал; False, если он ничего не изменил (схлопнут с предыдущим)'''
+    key = (body['chat_id'], body['participant_type'], signal_participant_id(body, claims))
+    if body['signal'] == 'typing':
+        cur.execute(
+            '''INSERT INTO t_p77168343_support_chat_project.chat_signals AS s 
+               (chat_id, participant_type, participant_id, participant_name, typing_until)
+               VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+               ON CONFLICT (chat_id, participant_type, participant_id) DO UPDATE 
+               SET typing_until = EXCLUDED.typing_until,
+                   participant_name = COALESCE(EXCLUDED.participant_name, s.participant_name)
+               WHERE s.typing_until IS NULL 
+                  OR CURRENT_TIMESTAMP + %s * INTERVAL '1 second' > s.typing_until''',
+            key + (body.get('participant_name'), TYPING_TTL_SECONDS, TYPING_REFRESH_SECONDS)
+        )
+    elif body['signal'] == 'stop_typing':
+        cur.execute(
+            '''UPDATE t_p77168343_support_chat_project.chat_signals SET typing_until = NULL 
+               WHERE chat_id = %s AND participant_type = %s AND participant_id = %s AND typing_until IS NOT NULL''',
+            key
+        )
+    else:
+        # Прочитанное только растёт; в chat_read_state его переносит планировщик (read_dirty)
+        cur.execute(
+            '''INSERT INTO t_p77168343_support_chat_project.chat_signals AS s 
+               (chat_id, participant_type, participant_id, participant_name, last_read_message_id, read_at, read_dirty)
+               VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP, true)
+               ON CONFLICT (chat_id, participant_type, participant_id) DO UPDATE 
+               SET last_read_message_id = EXCLUDED.last_read_message_id,
+                   read_at = EXCLUDED.read_at,
+                   read_dirty = true
+               WHERE s.last_read_message_id IS NULL OR s.last_read_message_id < EXCLUDED.last_read_message_id''',
+            key + (body.get('participant_name'), body['message_id'])
+        )
+    return cur.rowcount > 0
+
+
+def fetch_signals(cur, chat_id) -> List[Dict[str, Any]]:
+    '''Сигналы участников чата; прочитанное дополняется сохранённым, если эфемерная строка уже удалена'''
+    cur.execute(
+        '''SELECT COALESCE(s.participant_type, r.participant_type), COALESCE(s.participant_id, r.participant_id),
+                  s.participant_name, COALESCE(s.typing_until > CURRENT_TIMESTAMP, false),
+                  GREATEST(s.last_read_message_id, r.last_read_message_id), GREATEST(s.read_at, r.read_at)
+           FROM (SELECT * FROM t_p77168343_support_chat_project.chat_signals WHERE chat_id = %s) s
+           FULL JOIN (SELECT * FROM t_p77168343_support_chat_project.chat_read_state WHERE chat_id = %s) r
+             ON r.participant_type = s.participant_type AND r.participant_id = s.participant_id''',
+        (chat_id, chat_id)
+    )
+    return [{
+        'participant_type': row[0],
+        'participant_id': row[1],
+        'participant_name': row[2],
+        'typing': row[3],
+        'last_read_message_id': row[4],
+        'read_at': row[5].isoformat() if row[5] else None
+    } for row in cur.fetchall()]
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    # Сигналы набора и прочтения сбрасываются наравне с опросами
+    priority = 'poll' if event.get('httpMethod', 'GET') == 'GET' or parse_signal(event) else 'critical'
+    return handle_admitted(event, context, priority, handle_with_wal_position)
+
+
+def handle_with_wal_position(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return with_wal_position(handle_request, event, context)
+
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -18,7 +134,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id, X-Wal-Position, Idempotency-Key',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -26,11 +142,37 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        signal = parse_signal(event)
+        throttle_key = typing_throttle_key(signal, signal.get('participant_id')) if signal else None
+        if (throttle_key and signal['signal'] == 'typing'
+                and time.monotonic() - _typing_written.get(throttle_key, float('-inf')) < TYPING_REFRESH_SECONDS):
+            return {
+                'statusCode': 202,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'signal': 'typing', 'changed': False, 'throttled': True}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        params = event.get('queryStringParameters', {}) or {}
+        if method == 'GET' and not params.get('signals'):
+            conn = connect_for_read(event)
+        elif method == 'GET' or signal:
+            conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        else:
+            conn = psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=WalTrackingConnection)
         cur = conn.cursor()
         
+        claims, auth_error = verify_auth_token(event, cur)
+        if auth_error:
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': auth_error}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
         if method == 'GET':
-            params = event.get('queryStringParameters', {}) or {}
             chat_id = params.get('chat_id')
             
             if not chat_id:
@@ -59,6 +201,9 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'created_at': row[5].isoformat() if row[5] else None
             } for row in rows]
             
+            if params.get('signals'):
+                result = {'messages': result, 'signals': fetch_signals(cur, chat_id)}
+            
             cur.close()
             conn.close()
             
@@ -69,6 +214,41 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'isBase64Encoded': False
             }
         
+        elif method == 'POST' and signal:
+            if (signal['signal'] not in SIGNAL_TYPES or not signal.get('chat_id')
+                    or signal.get('participant_type') not in ('client', 'operator')
+                    or not signal_participant_id(signal, claims)
+                    or (signal['signal'] == 'read' and not signal.get('message_id'))):
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Invalid signal'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            
+            changed = apply_signal(cur, signal, claims)
+            conn.commit()
+            throttle_key = typing_throttle_key(signal, signal_participant_id(signal, claims))
+            cur.close()
+            conn.close()
+            
+            if throttle_key:
+                if len(_typing_written) > TYPING_THROTTLE_LIMIT:
+                    _typing_written.clear()
+                if signal['signal'] == 'typing' and changed:
+                    _typing_written[throttle_key] = time.monotonic()
+                elif signal['signal'] == 'stop_typing':
+                    _typing_written.pop(throttle_key, None)
+            
+            return {
+                'statusCode': 202,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'signal': signal['signal'], 'changed': changed}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
             chat_id = body.get('chat_id')
@@ -85,6 +265,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
+            idempotency_key, replay = claim_idempotency_key(cur, event, 'message')
+            if replay:
+                conn.rollback()
+                cur.close()
+                conn.close()
+                return replay
+            
             cur.execute(
                 '''INSERT INTO t_p77168343_support_chat_project.messages 
                    (chat_id, sender_type, sender_name, sender_id, content, created_at)
@@ -93,6 +280,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 (chat_id, sender_type, sender_name, sender_id, content)
             )
             message_id = cur.fetchone()[0]
+            result = {'id': message_id, 'message': 'Message sent'}
+            store_idempotent_response(cur, 'message', idempotency_key, 201, result)
             conn.commit()
             cur.close()
             conn.close()
@@ -100,7 +289,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             return {
                 'statusCode': 201,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'id': message_id, 'message': 'Message sent'}, ensure_ascii=False),
+                'body': json.dumps(result, ensure_ascii=False),
                 'isBase64Encoded': False
             }
         
@@ -119,3 +308,59 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': str(e)}, ensure_ascii=False),
             'isBase64Encoded': False
         }
+
+
+if __name__ == '__main__':
+    # Замер пропускной способности сигналов на реальной БД (DATABASE_URL): участники тестовых чатов
+    # с отрицательными id шлют "печатает" на каждое нажатие и иногда отметку прочтения.
+    # Отчёт - сигналов в секунду, доля схлопнутых (строка не менялась) и задержка; тестовые строки удаляются
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+    import shared.admission
+    
+    DURATION_SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    WORKERS = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    PARTICIPANTS_PER_WORKER = 5
+    shared.admission.ADMISSION_CONTROL = False
+    
+    def participant_loop(worker: int, stop_at: float) -> List[Tuple[int, bool, bool, float]]:
+        samples = []
+        sent = 0
+        while time.monotonic() < stop_at:
+            sent += 1
+            participant = worker * PARTICIPANTS_PER_WORKER + sent % PARTICIPANTS_PER_WORKER
+            body = {
+                'signal': 'read' if sent % 20 == 0 else 'typing',
+                'chat_id': -1 - participant // 2,
+                'participant_type': 'client',
+                'participant_id': f'bench-{participant}',
+                'message_id': sent
+            }
+            started = time.monotonic()
+            response = handler({'httpMethod': 'POST', 'headers': {}, 'body': json.dumps(body)}, None)
+            result = json.loads(response['body'])
+            samples.append((response['statusCode'], result.get('changed', False), result.get('throttled', False),
+                            time.monotonic() - started))
+        return samples
+    
+    stop_at = time.monotonic() + DURATION_SECONDS
+    with ThreadPoolExecutor(WORKERS) as pool:
+        samples = [s for f in [pool.submit(participant_loop, w, stop_at) for w in range(WORKERS)] for s in f.result()]
+    
+    ok = sorted(latency for status, _, _, latency in samples if status == 202)
+    changed = sum(1 for status, was_changed, _, _ in samples if status == 202 and was_changed)
+    throttled = sum(1 for status, _, was_throttled, _ in samples if status == 202 and was_throttled)
+    print(f'{len(samples)} signals from {WORKERS * PARTICIPANTS_PER_WORKER} participants in {DURATION_SECONDS:.0f} s: '
+          f'{len(samples) / DURATION_SECONDS:.0f} signals/s, {len(ok)} accepted, '
+          f'{throttled} answered without the DB ({throttled / max(len(ok), 1):.1%}), '
+          f'{changed} row writes ({changed / max(len(ok), 1):.1%})')
+    if ok:
+        print(f'latency p50 {ok[len(ok) // 2] * 1000:.1f} ms, p99 {ok[min(len(ok) - 1, int(len(ok) * 0.99))] * 1000:.1f} ms')
+    
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    cur.execute('DELETE FROM t_p77168343_support_chat_project.chat_signals WHERE chat_id < 0')
+    cur.execute('DELETE FROM t_p77168343_support_chat_project.chat_read_state WHERE chat_id < 0')
+    conn.commit()
+    cur.close()
+    conn.close()
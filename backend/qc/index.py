@@ -0,0 +1,287 @@
+'''
+Business: Очередь проверки ОКК - выдача чатов ревьюерам с арендой (lease), пакетное подтверждение и возврат
+Args: event - dict с httpMethod, body, queryStringParameters, headers
+      context - объект с атрибутами request_id, function_name
+Returns: HTTP response dict с выданными/подтверждёнными чатами
+'''
+import json
+import os
+import sys
+import psycopg2
+from typing import Dict, Any
+
+# Общий код функций (backend/shared) лежит каталогом выше index.py
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+from shared.auth_tokens import verify_auth_token
+
+# Аренда чата ревьюером; по истечении чат автоматически возвращается в очередь
+LEASE_SECONDS = int(os.environ.get('QC_LEASE_SECONDS', '900'))
+MAX_CLAIM_BATCH = 50
+
+
+def claimed_chat_to_dict(row) -> Dict[str, Any]:
+    return {
+        'id': row[0],
+        'client_name': row[1],
+        'client_phone': row[2],
+        'operator_id': row[3],
+        'operator_name': row[4],
+        'status': row[5],
+        'created_at': row[6].isoformat() if row[6] else None,
+        'closed_at': row[7].isoformat() if row[7] else None,
+        'resolution': row[8],
+        'resolution_comment': row[9],
+        'handling_time': row[10],
+        'qc_status': row[11],
+        'qc_lease_expires_at': row[12].isoformat() if row[12] else None,
+        'message_count': row[13]
+    }
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    try:
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cur = conn.cursor()
+        
+        claims, auth_error = verify_auth_token(event, cur)
+        if auth_error:
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': auth_error}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        if method == 'GET':
+            # Текущие аренды ревьюера (например, после перезагрузки страницы)
+            params = event.get('queryStringParameters', {}) or {}
+            reviewer_id = claims['sub'] if claims else params.get('reviewer_id')
+            if not reviewer_id:
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'reviewer_id required'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            
+            cur.execute(
+                '''SELECT c.id, c.client_name, c.client_phone, c.operator_id, s.name, c.status,
+                   c.created_at, c.closed_at, c.resolution, c.resolution_comment, c.handling_time,
+                   c.qc_status, c.qc_lease_expires_at,
+                   (SELECT COUNT(*) FROM t_p77168343_support_chat_project.messages m WHERE m.chat_id = c.id)
+                   FROM t_p77168343_support_chat_project.chats c
+                   LEFT JOIN t_p77168343_support_chat_project.staff s ON c.operator_id = s.id
+                   WHERE c.status = 'qc' AND c.qc_status = 'processing_qc' 
+                     AND c.qc_claimed_by = %s AND c.qc_lease_expires_at > CURRENT_TIMESTAMP
+                   ORDER BY c.closed_at, c.id''',
+                (int(reviewer_id),)
+            )
+            result = [claimed_chat_to_dict(row) for row in cur.fetchall()]
+            
+            cur.close()
+            conn.close()
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps(result, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        elif method == 'POST':
+            body = json.loads(event.get('body', '{}'))
+            action = body.get('action')
+            reviewer_id = claims['sub'] if claims else body.get('reviewer_id')
+            
+            if not reviewer_id or action not in ('claim', 'ack', 'release'):
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'reviewer_id and action (claim/ack/release) required'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            
+            # Выдать N следующих свободных чатов: занятые другими транзакциями пропускаются,
+            # просроченные аренды забираются повторно
+            if action == 'claim':
+                limit = max(1, min(int(body.get('limit', 10)), MAX_CLAIM_BATCH))
+                cur.execute(
+                    '''WITH next_chats AS (
+                           SELECT id FROM t_p77168343_support_chat_project.chats
+                           WHERE status = 'qc' 
+                             AND (qc_status = 'qc' OR qc_status IS NULL
+                                  OR (qc_status = 'processing_qc' 
+                                      AND (qc_lease_expires_at IS NULL OR qc_lease_expires_at < CURRENT_TIMESTAMP)))
+                           ORDER BY closed_at, id
+                           LIMIT %s
+                           FOR UPDATE SKIP LOCKED
+                       ), claimed AS (
+                           UPDATE t_p77168343_support_chat_project.chats c
+                           SET qc_status = 'processing_qc',
+                               qc_claimed_by = %s,
+                               qc_lease_expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                           FROM next_chats
+                           WHERE c.id = next_chats.id
+                           RETURNING c.id, c.client_name, c.client_phone, c.operator_id, c.status,
+                                     c.created_at, c.closed_at, c.resolution, c.resolution_comment, 
+                                     c.handling_time, c.qc_status, c.qc_lease_expires_at
+                       )
+                       SELECT cl.id, cl.client_name, cl.client_phone, cl.operator_id, s.name, cl.status,
+                              cl.created_at, cl.closed_at, cl.resolution, cl.resolution_comment, cl.handling_time,
+                              cl.qc_status, cl.qc_lease_expires_at,
+                              (SELECT COUNT(*) FROM t_p77168343_support_chat_project.messages m WHERE m.chat_id = cl.id)
+                       FROM claimed cl
+                       LEFT JOIN t_p77168343_support_chat_project.staff s ON cl.operator_id = s.id
+                       ORDER BY cl.closed_at, cl.id''',
+                    (limit, int(reviewer_id), LEASE_SECONDS)
+                )
+                result = {'chats': [claimed_chat_to_dict(row) for row in cur.fetchall()], 'lease_seconds': LEASE_SECONDS}
+            
+            # Пакетное подтверждение проверенных чатов (только своих аренд)
+            elif action == 'ack':
+                chat_ids = [int(chat_id) for chat_id in body.get('chat_ids', [])]
+                cur.execute(
+                    '''UPDATE t_p77168343_support_chat_project.chats 
+                       SET qc_status = 'closed', status = 'closed', qc_lease_expires_at = NULL
+                       WHERE id = ANY(%s) AND status = 'qc' AND qc_claimed_by = %s
+                       RETURNING id''',
+                    (chat_ids, int(reviewer_id))
+                )
+                acked = {row[0] for row in cur.fetchall()}
+                result = {'acked': sorted(acked), 'rejected': [chat_id for chat_id in chat_ids if chat_id not in acked]}
+            
+            # Вернуть невыполненные аренды в очередь
+            else:
+                chat_ids = [int(chat_id) for chat_id in body.get('chat_ids', [])]
+                cur.execute(
+                    '''UPDATE t_p77168343_support_chat_project.chats 
+                       SET qc_status = 'qc', qc_claimed_by = NULL, qc_lease_expires_at = NULL
+                       WHERE id = ANY(%s) AND status = 'qc' AND qc_status = 'processing_qc' AND qc_claimed_by = %s
+                       RETURNING id''',
+                    (chat_ids, int(reviewer_id))
+                )
+                result = {'released': sorted(row[0] for row in cur.fetchall())}
+            
+            conn.commit()
+            cur.close()
+            conn.close()
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps(result, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        else:
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 405,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Method not allowed'}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+    
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+
+
+if __name__ == '__main__':
+    # Стресс-проверка выдачи: ревьюеры параллельно забирают очередь пакетами (claim) и поштучно
+    # (PUT qc_status=processing_qc в функции chats). Ни один чат не должен достаться двоим.
+    # Нужны DATABASE_URL и чаты в статусе qc; все выданные аренды в конце возвращаются в очередь
+    import importlib.util
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    
+    REVIEWERS = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    BATCH = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    
+    spec = importlib.util.spec_from_file_location('chats_handler', os.path.join(BACKEND_DIR, 'chats', 'index.py'))
+    chats = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(chats)
+    
+    setup = psycopg2.connect(os.environ['DATABASE_URL'])
+    setup_cur = setup.cursor()
+    setup_cur.execute('SELECT id FROM t_p77168343_support_chat_project.staff ORDER BY id LIMIT %s', (REVIEWERS,))
+    reviewer_ids = [row[0] for row in setup_cur.fetchall()]
+    setup_cur.execute(
+        '''SELECT id FROM t_p77168343_support_chat_project.chats 
+           WHERE status = 'qc' AND (qc_status = 'qc' OR qc_status IS NULL) ORDER BY closed_at, id'''
+    )
+    single_targets = [row[0] for row in setup_cur.fetchall()]
+    setup.close()
+    
+    claimed: Dict[int, list] = {}
+    claimed_lock = threading.Lock()
+    
+    def record(chat_id: int, reviewer_id: int) -> None:
+        with claimed_lock:
+            claimed.setdefault(chat_id, []).append(reviewer_id)
+    
+    def review(index: int) -> None:
+        reviewer_id = reviewer_ids[index]
+        # Нечётные ревьюеры вперемешку с пакетами пытаются взять чаты поштучно из начала очереди
+        targets = iter(single_targets if index % 2 else [])
+        while True:
+            target = next(targets, None)
+            if target is not None:
+                response = chats.handler({
+                    'httpMethod': 'PUT', 'headers': {},
+                    'body': json.dumps({'id': target, 'qc_status': 'processing_qc', 'reviewer_id': reviewer_id})
+                }, None)
+                if response['statusCode'] == 200:
+                    record(target, reviewer_id)
+            response = handler({
+                'httpMethod': 'POST', 'headers': {},
+                'body': json.dumps({'action': 'claim', 'reviewer_id': reviewer_id, 'limit': BATCH})
+            }, None)
+            batch = json.loads(response['body']).get('chats', [])
+            for chat in batch:
+                record(chat['id'], reviewer_id)
+            if not batch and target is None:
+                return
+    
+    with ThreadPoolExecutor(len(reviewer_ids)) as pool:
+        list(pool.map(review, range(len(reviewer_ids))))
+    
+    duplicates = {chat_id: owners for chat_id, owners in claimed.items() if len(owners) > 1}
+    for reviewer_id in reviewer_ids:
+        owned = [chat_id for chat_id, owners in claimed.items() if reviewer_id in owners]
+        handler({
+            'httpMethod': 'POST', 'headers': {},
+            'body': json.dumps({'action': 'release', 'reviewer_id': reviewer_id, 'chat_ids': owned})
+        }, None)
+    print(f'{len(reviewer_ids)} reviewers claimed {len(claimed)} chats, duplicates: {len(duplicates)}')
+    if duplicates:
+        print(json.dumps(duplicates))
+        sys.exit(1)
@@ -6,10 +6,23 @@ Returns: HTTP response dict с данными оценок
 '''
 import json
 import os
+import sys
 import psycopg2
 from typing import Dict, Any
 
+# Общий код функций (backend/shared) лежит каталогом выше index.py
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+from shared.auth_tokens import verify_auth_token
+from shared.replica import WalTrackingConnection, connect_for_read, with_wal_position
+
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return with_wal_position(handle_request, event, context)
+
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -18,7 +31,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Wal-Position',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -26,9 +39,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        if method == 'GET':
+            conn = connect_for_read(event)
+        else:
+            conn = psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=WalTrackingConnection)
         cur = conn.cursor()
         
+        claims, auth_error = verify_auth_token(event, cur)
+        if auth_error:
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': auth_error}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
         if method == 'GET':
             params = event.get('queryStringParameters', {})
             operator_id = params.get('operator_id')
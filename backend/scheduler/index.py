@@ -0,0 +1,288 @@
+'''
+Business: Планировщик - возвращает отложенные чаты в работу в момент scheduled_for, закрывает интервалы учёта времени операторов с истёкшим присутствием, чистит устаревшие служебные записи, переносит отметки прочтения в постоянную таблицу, отдаёт метрики отставания
+Args: event - dict с httpMethod (GET - метрики, POST с заголовком X-Scheduler-Token или таймер-триггер - обработка пачек)
+      context - объект с атрибутами request_id, function_name
+Returns: HTTP response dict с результатом прогона или метриками очереди
+'''
+import hmac
+import json
+import os
+import sys
+import time
+import psycopg2
+from typing import Dict, Any
+
+# Общий код функций (backend/shared) лежит каталогом выше index.py
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+from shared.time_tracking import close_expired_intervals
+
+BATCH_SIZE = int(os.environ.get('SCHEDULER_BATCH_SIZE', '200'))
+MAX_BATCHES_PER_RUN = int(os.environ.get('SCHEDULER_MAX_BATCHES', '10'))
+DUE_COUNT_LIMIT = 10000
+TOMBSTONE_RETENTION_SECONDS = 86400
+IDEMPOTENCY_PRUNE_LIMIT = 5000
+READ_FLUSH_BATCH_SIZE = 1000
+SIGNAL_RETENTION_SECONDS = 3600
+# Таймер переоткрытого чата - та же настройка, что у функции chats
+CHAT_TIMER_MINUTES = int(os.environ.get('CHAT_TIMER_MINUTES', '15'))
+# Общий секрет для ручного запуска прогона по HTTP; без него прогон запускает только таймер-триггер
+SCHEDULER_SECRET = os.environ.get('SCHEDULER_SECRET', '')
+
+# Итог последнего прогона на этом экземпляре функции; холодный экземпляр его не знает
+_last_run: Dict[str, Any] = {}
+
+
+def is_timer_trigger(event: Dict[str, Any]) -> bool:
+    '''Событие таймер-триггера: без httpMethod, с сообщением TimerMessage'''
+    if event.get('httpMethod'):
+        return False
+    messages = event.get('messages') or []
+    return bool(messages) and all(
+        str((message.get('event_metadata') or {}).get('event_type', '')).endswith('TimerMessage')
+        for message in messages
+    )
+
+
+def is_authorized_run(event: Dict[str, Any]) -> bool:
+    if is_timer_trigger(event):
+        return True
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    token = headers.get('x-scheduler-token') or ''
+    return bool(SCHEDULER_SECRET) and hmac.compare_digest(token.encode(), SCHEDULER_SECRET.encode())
+
+
+def reopen_due_batch(cur) -> Dict[str, Any]:
+    '''
+    Переоткрывает до BATCH_SIZE просроченных отложенных чатов (по частичному индексу на scheduled_for).
+    Исходный оператор получает чат, если он на линии; остальные чаты распределяются по
+    операторам на линии с учётом нагрузки, а если на линии никого - остаются у исходного
+    '''
+    cur.execute(
+        '''WITH due AS (
+               SELECT id, operator_id, scheduled_for FROM t_p77168343_support_chat_project.chats
+               WHERE status = 'closed' AND resolution = 'postponed' AND scheduled_for <= CURRENT_TIMESTAMP
+               ORDER BY scheduled_for
+               LIMIT %s
+               FOR UPDATE SKIP LOCKED
+           ), online AS (
+               SELECT p.staff_id,
+                      (SELECT COUNT(*) FROM t_p77168343_support_chat_project.chats c 
+                       WHERE c.operator_id = p.staff_id AND c.status = 'active') AS load
+               FROM t_p77168343_support_chat_project.operator_presence p
+               WHERE p.status = 'online' AND p.expires_at > CURRENT_TIMESTAMP
+           ), unrouted AS (
+               SELECT id, ROW_NUMBER() OVER (ORDER BY scheduled_for, id) AS rn FROM due
+               WHERE operator_id IS NULL OR operator_id NOT IN (SELECT staff_id FROM online)
+           ), slots AS (
+               SELECT staff_id, ROW_NUMBER() OVER (ORDER BY slot, staff_id) AS rn
+               FROM online, generate_series(load + 1, load + (SELECT COUNT(*) FROM unrouted)) AS slot
+           ), assignment AS (
+               SELECT d.id, d.scheduled_for,
+                      CASE WHEN u.id IS NULL THEN d.operator_id ELSE COALESCE(s.staff_id, d.operator_id) END AS staff_id,
+                      u.id IS NULL AS to_original
+               FROM due d
+               LEFT JOIN unrouted u ON u.id = d.id
+               LEFT JOIN slots s ON s.rn = u.rn
+           ), updated AS (
+               UPDATE t_p77168343_support_chat_project.chats ch
+               SET status = 'active',
+                   resolution = NULL,
+                   operator_id = a.staff_id,
+                   started_at = CURRENT_TIMESTAMP,
+                   closed_at = NULL,
+                   timer_expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 minute',
+                   timer_extended = 0,
+                   scheduled_for = NULL
+               FROM assignment a
+               WHERE ch.id = a.id
+               RETURNING ch.id, a.to_original, a.scheduled_for
+           )
+           SELECT COUNT(*), COUNT(*) FILTER (WHERE to_original),
+                  COALESCE(MAX(EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - scheduled_for)), 0)
+           FROM updated''',
+        (BATCH_SIZE, CHAT_TIMER_MINUTES)
+    )
+    reopened, to_original, max_lag = cur.fetchone()
+    return {'reopened': reopened, 'to_original_operator': to_original, 'max_lag_seconds': float(max_lag)}
+
+
+def flush_read_state_batch(cur) -> int:
+    '''Переносит до READ_FLUSH_BATCH_SIZE изменённых отметок прочтения из chat_signals в chat_read_state'''
+    cur.execute(
+        '''WITH dirty AS (
+               SELECT chat_id, participant_type, participant_id 
+               FROM t_p77168343_support_chat_project.chat_signals 
+               WHERE read_dirty 
+               LIMIT %s 
+               FOR UPDATE SKIP LOCKED
+           ), flushed AS (
+               UPDATE t_p77168343_support_chat_project.chat_signals s 
+               SET read_dirty = false 
+               FROM dirty d 
+               WHERE s.chat_id = d.chat_id AND s.participant_type = d.participant_type 
+                 AND s.participant_id = d.participant_id
+               RETURNING s.chat_id, s.participant_type, s.participant_id, s.last_read_message_id, s.read_at
+           )
+           INSERT INTO t_p77168343_support_chat_project.chat_read_state AS r 
+           (chat_id, participant_type, participant_id, last_read_message_id, read_at)
+           SELECT chat_id, participant_type, participant_id, last_read_message_id, read_at FROM flushed
+           ON CONFLICT (chat_id, participant_type, participant_id) DO UPDATE 
+           SET last_read_message_id = GREATEST(r.last_read_message_id, EXCLUDED.last_read_message_id),
+               read_at = GREATEST(r.read_at, EXCLUDED.read_at)''',
+        (READ_FLUSH_BATCH_SIZE,)
+    )
+    return cur.rowcount
+
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    method: str = event.get('httpMethod', 'POST')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Scheduler-Token',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    if method != 'GET' and not is_authorized_run(event):
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Scheduler run requires a timer trigger or X-Scheduler-Token'}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    
+    try:
+        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        cur = conn.cursor()
+        
+        # Метрики отставания: всё читается из частичного индекса, без сканирования chats
+        if method == 'GET':
+            cur.execute(
+                '''SELECT 
+                   (SELECT MIN(scheduled_for) FROM t_p77168343_support_chat_project.chats
+                    WHERE status = 'closed' AND resolution = 'postponed'),
+                   (SELECT COUNT(*) FROM (
+                       SELECT 1 FROM t_p77168343_support_chat_project.chats
+                       WHERE status = 'closed' AND resolution = 'postponed' AND scheduled_for <= CURRENT_TIMESTAMP
+                       LIMIT %s) due),
+                   CURRENT_TIMESTAMP''',
+                (DUE_COUNT_LIMIT,)
+            )
+            next_scheduled, due_count, now = cur.fetchone()
+            cur.close()
+            conn.close()
+            
+            lag_seconds = max(0.0, (now - next_scheduled).total_seconds()) if next_scheduled else 0.0
+            result = {
+                'due_count': due_count,
+                'due_count_capped': due_count >= DUE_COUNT_LIMIT,
+                'next_scheduled_for': next_scheduled.isoformat() if next_scheduled else None,
+                'oldest_due_lag_seconds': lag_seconds if next_scheduled and next_scheduled <= now else 0.0,
+                'last_run': _last_run or None,
+                'last_run_scope': 'instance'
+            }
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps(result, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
+        # Прогон: пачки по BATCH_SIZE, каждая в своей транзакции, не больше MAX_BATCHES_PER_RUN за вызов
+        started = time.time()
+        totals = {'batches': 0, 'reopened': 0, 'to_original_operator': 0, 'max_lag_seconds': 0.0}
+        for _ in range(MAX_BATCHES_PER_RUN):
+            batch = reopen_due_batch(cur)
+            conn.commit()
+            totals['batches'] += 1
+            totals['reopened'] += batch['reopened']
+            totals['to_original_operator'] += batch['to_original_operator']
+            totals['max_lag_seconds'] = max(totals['max_lag_seconds'], batch['max_lag_seconds'])
+            if batch['reopened'] < BATCH_SIZE:
+                break
+        
+        # Операторы, чьё присутствие истекло без выхода (закрыт браузер): интервал time_tracking
+        # закрывается моментом истечения, иначе он растёт до следующей смены статуса
+        totals['expired_intervals_closed'] = 0
+        for _ in range(MAX_BATCHES_PER_RUN):
+            closed = close_expired_intervals(cur, BATCH_SIZE)
+            conn.commit()
+            totals['expired_intervals_closed'] += len(closed)
+            if len(closed) < BATCH_SIZE:
+                break
+        
+        # Очистка надгробий дельта-синхронизации и сдвиг границы для клиентов со старым курсором
+        cur.execute(
+            '''WITH pruned AS (
+                   DELETE FROM t_p77168343_support_chat_project.chat_tombstones
+                   WHERE removed_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+                   RETURNING seq
+               )
+               UPDATE t_p77168343_support_chat_project.chat_sync_state 
+               SET pruned_through_seq = GREATEST(pruned_through_seq, (SELECT MAX(seq) FROM pruned))
+               WHERE id = 1 AND EXISTS (SELECT 1 FROM pruned)''',
+            (TOMBSTONE_RETENTION_SECONDS,)
+        )
+        conn.commit()
+        
+        # Истёкшие ключи идемпотентности; ограничение пачки держит блокировки короткими
+        cur.execute(
+            '''DELETE FROM t_p77168343_support_chat_project.idempotency_keys 
+               WHERE ctid = ANY(ARRAY(
+                   SELECT ctid FROM t_p77168343_support_chat_project.idempotency_keys 
+                   WHERE expires_at <= CURRENT_TIMESTAMP 
+                   LIMIT %s
+               ))''',
+            (IDEMPOTENCY_PRUNE_LIMIT,)
+        )
+        totals['idempotency_keys_pruned'] = cur.rowcount
+        conn.commit()
+        
+        # Отметки прочтения - в постоянную таблицу пачками; затем удаляются давно неактивные сигналы
+        totals['read_states_flushed'] = 0
+        for _ in range(MAX_BATCHES_PER_RUN):
+            flushed = flush_read_state_batch(cur)
+            conn.commit()
+            totals['read_states_flushed'] += flushed
+            if flushed < READ_FLUSH_BATCH_SIZE:
+                break
+        cur.execute(
+            '''DELETE FROM t_p77168343_support_chat_project.chat_signals 
+               WHERE NOT read_dirty 
+                 AND CURRENT_TIMESTAMP - %s * INTERVAL '1 second' > COALESCE(GREATEST(typing_until, read_at), '-infinity'::timestamp)''',
+            (SIGNAL_RETENTION_SECONDS,)
+        )
+        conn.commit()
+        
+        cur.close()
+        conn.close()
+        
+        totals['duration_ms'] = int((time.time() - started) * 1000)
+        _last_run.clear()
+        _last_run.update(totals, finished_at=time.time())
+        print(f"Scheduler run: {json.dumps(totals)}")
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(totals, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': str(e)}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
@@ -0,0 +1,4 @@
+'''
+Общий код функций backend. Каталог shared деплоится рядом с каталогами функций;
+функции подключают его через sys.path (родительский каталог своего index.py)
+'''
@@ -0,0 +1,247 @@
+'''
+Контроль допуска для функций с потоком опросов (chats, messages): лимит частоты (опросы - по сессии,
+записи - отдельным бакетом по сотруднику из подписанного токена или IP), лимит одновременной работы с БД и приоритетный сброс - опросы ('poll') отклоняются с Retry-After раньше,
+чем создание чатов, сообщения и действия операторов ('critical').
+Всё состояние (слоты, EWMA задержки, бакеты сессий) живёт в памяти экземпляра: лимиты действуют на
+экземпляр, и N прогретых экземпляров вместе пропускают до N * DB_MAX_CONCURRENCY запросов к БД
+'''
+import json
+import math
+import os
+import random
+import threading
+import time
+from typing import Dict, Any, Callable, Optional, Tuple
+
+from .auth_tokens import decode_token
+
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', '1') == '1'
+DB_MAX_CONCURRENCY = int(os.environ.get('DB_MAX_CONCURRENCY', '8'))
+POLL_MAX_CONCURRENCY = int(os.environ.get('POLL_MAX_CONCURRENCY', str(max(1, DB_MAX_CONCURRENCY // 2))))
+CRITICAL_QUEUE_TIMEOUT = float(os.environ.get('CRITICAL_QUEUE_TIMEOUT', '3'))
+# Средняя (EWMA) длительность запросов этого экземпляра, с которой опросы начинают отбрасываться;
+# при двойной - отбрасываются все. Другие экземпляры считают свою среднюю независимо
+POLL_SHED_LATENCY_MS = float(os.environ.get('POLL_SHED_LATENCY_MS', '300'))
+POLL_RETRY_AFTER_SECONDS = 5
+LATENCY_EWMA_ALPHA = 0.2
+LATENCY_STALE_SECONDS = 10
+SESSION_BUCKET_CAPACITY = 30
+SESSION_BUCKET_RATE = 1.0
+# Записи не делят бакет с опросами: иначе частые опросы той же сессии отнимали бы токены у сообщений.
+# Ключ бакета записи не берётся из заголовков и тела, которые клиент может подменить
+CRITICAL_BUCKET_CAPACITY = 60
+CRITICAL_BUCKET_RATE = 2.0
+LOCAL_BUCKETS_LIMIT = 10000
+
+_admission_cond = threading.Condition()
+_admission: Dict[str, Any] = {
+    'inflight': 0, 'peak_inflight': 0, 'critical_waiting': 0, 'latency_ewma_ms': 0.0, 'latency_updated_at': 0.0
+}
+_admission_counters: Dict[str, int] = {}
+_session_buckets: Dict[str, Tuple[float, float]] = {}
+
+
+def admission_session_key(event: Dict[str, Any]) -> str:
+    '''Сессия клиента из X-Session-Id или тела запроса, иначе сотрудник, иначе IP'''
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if headers.get('x-session-id'):
+        return f"session:{headers['x-session-id']}"
+    if event.get('httpMethod') in ('POST', 'PUT'):
+        try:
+            body = json.loads(event.get('body') or '{}')
+        except ValueError:
+            body = {}
+        if isinstance(body, dict) and body.get('session_id'):
+            return f"session:{body['session_id']}"
+    if headers.get('x-user-id'):
+        return f"staff:{headers['x-user-id']}"
+    return f"ip:{(event.get('requestContext') or {}).get('identity', {}).get('sourceIp', 'unknown')}"
+
+
+def admission_critical_key(event: Dict[str, Any]) -> str:
+    '''Бакет записи: sub токена с проверенной подписью (без обращения к БД), иначе IP источника'''
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    if headers.get('x-auth-token'):
+        claims, error = decode_token(headers['x-auth-token'])
+        if not error and claims.get('sub') is not None:
+            return f"critical:staff:{claims['sub']}"
+    return f"critical:ip:{(event.get('requestContext') or {}).get('identity', {}).get('sourceIp', 'unknown')}"
+
+
+def take_session_token(key: str, capacity: float = SESSION_BUCKET_CAPACITY, rate: float = SESSION_BUCKET_RATE) -> int:
+    '''Списывает токен из локального бакета; возвращает Retry-After или 0. Вызывать под _admission_cond'''
+    now = time.time()
+    tokens, updated_at = _session_buckets.get(key, (capacity, now))
+    tokens = min(capacity, tokens + (now - updated_at) * rate)
+    if tokens < 1:
+        _session_buckets[key] = (tokens, now)
+        return math.ceil((1 - tokens) / rate)
+    if len(_session_buckets) > LOCAL_BUCKETS_LIMIT:
+        _session_buckets.clear()
+    _session_buckets[key] = (tokens - 1, now)
+    return 0
+
+
+def poll_shed_probability() -> float:
+    latency = _admission['latency_ewma_ms']
+    if time.time() - _admission['latency_updated_at'] > LATENCY_STALE_SECONDS or latency <= POLL_SHED_LATENCY_MS:
+        return 0.0
+    return min(1.0, (latency - POLL_SHED_LATENCY_MS) / POLL_SHED_LATENCY_MS)
+
+
+def overload_response(status_code: int, retry_after: int, error: str) -> Dict[str, Any]:
+    return {
+        'statusCode': status_code,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'Retry-After',
+            'Retry-After': str(retry_after)
+        },
+        'body': json.dumps({'error': error}, ensure_ascii=False),
+        'isBase64Encoded': False
+    }
+
+
+def admit_request(event: Dict[str, Any], priority: str) -> Optional[Dict[str, Any]]:
+    '''None - запрос допущен и занял слот (освобождается release_request), иначе ответ 429/503'''
+    with _admission_cond:
+        if priority == 'poll':
+            retry_after = take_session_token(admission_session_key(event))
+        else:
+            retry_after = take_session_token(admission_critical_key(event), CRITICAL_BUCKET_CAPACITY, CRITICAL_BUCKET_RATE)
+        if retry_after:
+            _admission_counters[f'throttled_{priority}'] = _admission_counters.get(f'throttled_{priority}', 0) + 1
+            return overload_response(429, retry_after, 'Too many requests')
+        
+        if priority == 'poll':
+            # Опрос не ждёт слота: при ожидающих записях, занятой доле слотов или росте задержки БД - сразу 503
+            if (_admission['critical_waiting'] or _admission['inflight'] >= POLL_MAX_CONCURRENCY
+                    or random.random() < poll_shed_probability()):
+                _admission_counters['shed_poll'] = _admission_counters.get('shed_poll', 0) + 1
+                return overload_response(503, POLL_RETRY_AFTER_SECONDS, 'Service overloaded, retry later')
+        else:
+            deadline = time.monotonic() + CRITICAL_QUEUE_TIMEOUT
+            _admission['critical_waiting'] += 1
+            try:
+                while _admission['inflight'] >= DB_MAX_CONCURRENCY:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        _admission_counters['shed_critical'] = _admission_counters.get('shed_critical', 0) + 1
+                        return overload_response(503, 1, 'Service overloaded, retry later')
+                    _admission_cond.wait(remaining)
+            finally:
+                _admission['critical_waiting'] -= 1
+        
+        _admission['inflight'] += 1
+        _admission['peak_inflight'] = max(_admission['peak_inflight'], _admission['inflight'])
+        _admission_counters[f'admitted_{priority}'] = _admission_counters.get(f'admitted_{priority}', 0) + 1
+    return None
+
+
+def release_request(duration_seconds: float) -> None:
+    with _admission_cond:
+        _admission['inflight'] -= 1
+        _admission['latency_ewma_ms'] += LATENCY_EWMA_ALPHA * (duration_seconds * 1000 - _admission['latency_ewma_ms'])
+        _admission['latency_updated_at'] = time.time()
+        _admission_cond.notify()
+
+
+def admission_stats() -> Dict[str, Any]:
+    with _admission_cond:
+        return {
+            **_admission_counters,
+            'scope': 'instance',
+            'inflight': _admission['inflight'],
+            'peak_inflight': _admission['peak_inflight'],
+            'latency_ewma_ms': round(_admission['latency_ewma_ms'], 1),
+            'poll_shed_probability': round(poll_shed_probability(), 3),
+            'limits': {
+                'db_max_concurrency': DB_MAX_CONCURRENCY,
+                'poll_max_concurrency': POLL_MAX_CONCURRENCY,
+                'critical_queue_timeout': CRITICAL_QUEUE_TIMEOUT,
+                'poll_shed_latency_ms': POLL_SHED_LATENCY_MS,
+                'session_bucket': [SESSION_BUCKET_CAPACITY, SESSION_BUCKET_RATE],
+                'critical_bucket': [CRITICAL_BUCKET_CAPACITY, CRITICAL_BUCKET_RATE]
+            }
+        }
+
+
+def handle_admitted(event: Dict[str, Any], context: Any, priority: str,
+                    handle: Callable[[Dict[str, Any], Any], Dict[str, Any]]) -> Dict[str, Any]:
+    '''Выполняет handle(event, context), если запрос прошёл контроль допуска; GET ?admission=1 - статистика'''
+    method = event.get('httpMethod', 'GET')
+    if method == 'GET' and (event.get('queryStringParameters') or {}).get('admission'):
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(admission_stats(), ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    if not ADMISSION_CONTROL or method == 'OPTIONS':
+        return handle(event, context)
+    
+    rejected = admit_request(event, priority)
+    if rejected:
+        return rejected
+    started = time.monotonic()
+    try:
+        return handle(event, context)
+    finally:
+        release_request(time.monotonic() - started)
+
+
+if __name__ == '__main__':
+    # Нагрузочный прогон политики допуска без БД: обработчик заменён моделью насыщаемой базы,
+    # у которой время запроса растёт пропорционально числу одновременных запросов сверх её ёмкости.
+    # Сравнивает задержку записей (POST) и опросов (GET) с контролем допуска и без него.
+    # Запуск из backend: python -m shared.admission [секунды]
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+    
+    DB_CAPACITY = 8
+    BASE_SERVICE_SECONDS = 0.02
+    DURATION_SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    POLL_CLIENTS, WRITE_CLIENTS = 400, 40
+    _db_active = [0]
+    _db_lock = threading.Lock()
+    
+    def simulated_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        with _db_lock:
+            _db_active[0] += 1
+            load = _db_active[0]
+        time.sleep(BASE_SERVICE_SECONDS * max(1.0, load / DB_CAPACITY))
+        with _db_lock:
+            _db_active[0] -= 1
+        return {'statusCode': 201 if event['httpMethod'] == 'POST' else 200, 'headers': {}, 'body': '{}'}
+    
+    def client(method: str, session: str, think_seconds: float, stop_at: float) -> list:
+        samples = []
+        time.sleep(random.uniform(0, think_seconds))
+        while time.monotonic() < stop_at:
+            started = time.monotonic()
+            event = {'httpMethod': method, 'headers': {'X-Session-Id': session}, 'body': '{}',
+                     'requestContext': {'identity': {'sourceIp': session}}}
+            response = handle_admitted(event, None, 'poll' if method == 'GET' else 'critical', simulated_request)
+            samples.append((response['statusCode'], time.monotonic() - started))
+            time.sleep(random.uniform(0.5, 1.5) * think_seconds)
+        return samples
+    
+    def percentile(values: list, q: float) -> float:
+        return sorted(values)[min(len(values) - 1, int(len(values) * q))] * 1000 if values else 0.0
+    
+    for enabled in (False, True):
+        ADMISSION_CONTROL = enabled
+        _admission_counters.clear()
+        stop_at = time.monotonic() + DURATION_SECONDS
+        with ThreadPoolExecutor(POLL_CLIENTS + WRITE_CLIENTS) as pool:
+            polls = [pool.submit(client, 'GET', f'poll-{i}', 1.0, stop_at) for i in range(POLL_CLIENTS)]
+            writes = [pool.submit(client, 'POST', f'write-{i}', 2.0, stop_at) for i in range(WRITE_CLIENTS)]
+            results = {'POST': [s for f in writes for s in f.result()], 'GET': [s for f in polls for s in f.result()]}
+        print(f'admission control {"on" if enabled else "off"}:')
+        for method, samples in results.items():
+            ok = [latency for status, latency in samples if status < 400]
+            print(f'  {method}: {len(ok)}/{len(samples)} ok, p50 {percentile(ok, 0.5):.0f} ms, '
+                  f'p99 {percentile(ok, 0.99):.0f} ms, max {percentile(ok, 1.0):.0f} ms')
+        if enabled:
+            print(f'  {json.dumps(admission_stats())}')
@@ -0,0 +1,96 @@
+'''
+Подписанные токены сотрудников: ключи подписи, проверка подписи и срока, denylist отозванных токенов.
+Выдаёт токены функция auth; остальные функции проверяют их через verify_auth_token
+'''
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Dict, Any, Optional, Set, Tuple
+
+DENYLIST_REFRESH_SECONDS = 60
+
+_signing_keys: Optional[Dict[str, bytes]] = None
+_denylist: Set[str] = set()
+_denylist_loaded_at = 0.0
+
+
+def b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def get_signing_keys() -> Dict[str, bytes]:
+    '''
+    Ключи подписи из AUTH_TOKEN_SECRETS в формате "kid:secret,kid:secret".
+    Первым идёт текущий ключ, остальные принимаются только для проверки (ротация).
+    '''
+    global _signing_keys
+    if _signing_keys is None:
+        keys: Dict[str, bytes] = {}
+        for item in os.environ.get('AUTH_TOKEN_SECRETS', '').split(','):
+            if ':' in item:
+                kid, secret = item.split(':', 1)
+                keys[kid.strip()] = secret.strip().encode()
+        if not keys and os.environ.get('AUTH_TOKEN_SECRET'):
+            keys['default'] = os.environ['AUTH_TOKEN_SECRET'].encode()
+        _signing_keys = keys
+    return _signing_keys
+
+
+def decode_token(token: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    '''Проверка подписи и срока действия токена без обращения к БД'''
+    try:
+        version, kid, payload, signature = token.split('.')
+        key = get_signing_keys().get(kid)
+        if version != 'v1' or key is None:
+            return None, 'Unknown signing key'
+        expected = hmac.new(key, f'{version}.{kid}.{payload}'.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, b64decode(signature)):
+            return None, 'Invalid auth token'
+        claims = json.loads(b64decode(payload))
+    except (ValueError, TypeError):
+        return None, 'Malformed auth token'
+    if claims.get('exp', 0) < time.time():
+        return None, 'Auth token expired'
+    return claims, None
+
+
+def get_denylist(cur) -> Set[str]:
+    '''Отозванные jti кешируются в памяти и перечитываются не чаще раза в минуту'''
+    global _denylist, _denylist_loaded_at
+    if time.time() - _denylist_loaded_at > DENYLIST_REFRESH_SECONDS:
+        cur.execute(
+            '''SELECT jti FROM t_p77168343_support_chat_project.revoked_tokens 
+               WHERE expires_at > CURRENT_TIMESTAMP'''
+        )
+        _denylist = {row[0] for row in cur.fetchall()}
+        _denylist_loaded_at = time.time()
+    return _denylist
+
+
+def verify_auth_token(event: Dict[str, Any], cur) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    '''
+    Возвращает (claims, None) для валидного X-Auth-Token, (None, None) если токена нет
+    и AUTH_REQUIRED не включён, иначе (None, текст ошибки)
+    '''
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    token = headers.get('x-auth-token')
+    if not token:
+        if os.environ.get('AUTH_REQUIRED') == '1':
+            return None, 'Missing auth token'
+        return None, None
+    claims, error = decode_token(token)
+    if error:
+        return None, error
+    if claims.get('jti') in get_denylist(cur):
+        return None, 'Auth token revoked'
+    user_id = headers.get('x-user-id')
+    if user_id and str(claims.get('sub')) != str(user_id):
+        return None, 'Auth token does not match X-User-Id'
+    return claims, None
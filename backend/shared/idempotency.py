@@ -0,0 +1,83 @@
+'''
+Идемпотентность POST по заголовку Idempotency-Key (chats, messages): ключ фиксируется в той же
+транзакции, что и вставка, поэтому повтор после обрыва связи получает исходный ответ, а не дубликат
+'''
+import hashlib
+import json
+import os
+import psycopg2
+from typing import Dict, Any, Optional, Tuple
+
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+
+
+def claim_idempotency_key(cur, event: Dict[str, Any], scope: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+    '''(ключ, None) - выполнить запрос и сохранить ответ; (None, ответ) - повтор или конфликт; (None, None) - без ключа'''
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    key = (headers.get('idempotency-key') or '').strip()
+    if not key:
+        return None, None
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        return None, {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Idempotency-Key too long'}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    request_hash = hashlib.sha256((event.get('body') or '').encode('utf-8')).digest()
+    # Параллельный запрос с тем же ключом ждёт на уникальном индексе, пока первый не завершит транзакцию;
+    # истёкший ключ переиспользуется
+    cur.execute(
+        '''INSERT INTO t_p77168343_support_chat_project.idempotency_keys 
+           (scope, key, request_hash, expires_at)
+           VALUES (%s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+           ON CONFLICT (scope, key) DO UPDATE 
+           SET request_hash = EXCLUDED.request_hash, status_code = NULL, response = NULL, 
+               expires_at = EXCLUDED.expires_at
+           WHERE idempotency_keys.expires_at <= CURRENT_TIMESTAMP
+           RETURNING key''',
+        (scope, key, psycopg2.Binary(request_hash), IDEMPOTENCY_TTL_SECONDS)
+    )
+    if cur.fetchone():
+        return key, None
+    
+    cur.execute(
+        '''SELECT status_code, response, request_hash = %s 
+           FROM t_p77168343_support_chat_project.idempotency_keys 
+           WHERE scope = %s AND key = %s''',
+        (psycopg2.Binary(request_hash), scope, key)
+    )
+    status_code, response, same_request = cur.fetchone()
+    if not same_request:
+        return None, {
+            'statusCode': 422,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Idempotency-Key reused with a different request'}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    if status_code is None:
+        return None, {
+            'statusCode': 409,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Request with this Idempotency-Key is in progress'}, ensure_ascii=False),
+            'isBase64Encoded': False
+        }
+    return None, {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', 'Idempotent-Replayed': 'true',
+                    'Access-Control-Expose-Headers': 'Idempotent-Replayed'},
+        'body': json.dumps(response, ensure_ascii=False),
+        'isBase64Encoded': False
+    }
+
+
+def store_idempotent_response(cur, scope: str, key: Optional[str], status_code: int, result: Dict[str, Any]) -> None:
+    if not key:
+        return
+    cur.execute(
+        '''UPDATE t_p77168343_support_chat_project.idempotency_keys 
+           SET status_code = %s, response = %s 
+           WHERE scope = %s AND key = %s''',
+        (status_code, json.dumps(result, ensure_ascii=False), scope, key)
+    )
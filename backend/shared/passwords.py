@@ -0,0 +1,46 @@
+'''
+Хеширование паролей сотрудников (scrypt): используется при входе (auth) и при создании
+и смене пароля (staff). Формат хеша: scrypt$N$r$p$<salt>$<digest>
+'''
+import hashlib
+import hmac
+import os
+from typing import Tuple
+
+from .auth_tokens import b64decode, b64encode
+
+# Параметры scrypt; AUTH_SCRYPT_N подбирается через `python auth/index.py` (~50 мс на хеш)
+SCRYPT_N = int(os.environ.get('AUTH_SCRYPT_N', '16384'))
+SCRYPT_R = 8
+SCRYPT_P = 1
+# Верхняя граница N из сохранённого хеша: битая запись не должна съесть память инстанса
+SCRYPT_MAX_N = 1 << 17
+
+
+def scrypt_digest(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=32)
+
+
+def hash_password(password: str) -> str:
+    salt = os.urandom(16)
+    digest = scrypt_digest(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f'scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${b64encode(salt)}${b64encode(digest)}'
+
+
+def verify_password(password: str, stored: str) -> Tuple[bool, bool]:
+    '''
+    Возвращает (пароль верный, нужно перехешировать текущими параметрами).
+    Открытый пароль (до миграции) сравнивается напрямую; повреждённый scrypt-хеш - неверный пароль
+    '''
+    if not stored.startswith('scrypt$'):
+        ok = hmac.compare_digest(stored.encode(), password.encode())
+        return ok, ok
+    try:
+        _, n, r, p, salt, digest = stored.split('$')
+        n, r, p = int(n), int(r), int(p)
+        if not 1 < n <= SCRYPT_MAX_N or n & (n - 1) or not 1 <= r <= 16 or not 1 <= p <= 16:
+            return False, False
+        ok = hmac.compare_digest(scrypt_digest(password, b64decode(salt), n, r, p), b64decode(digest))
+    except ValueError:
+        return False, False
+    return ok, ok and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
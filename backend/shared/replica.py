@@ -0,0 +1,65 @@
+'''
+Маршрутизация чтения на реплику (DATABASE_REPLICA_URL) с гарантией read-your-writes:
+после записи клиент получает X-Wal-Position и передаёт его в следующих GET.
+Состояние запроса (WAL-позиция записи, выбранный для чтения сервер) - своё у каждого потока
+'''
+import os
+import threading
+import psycopg2
+import psycopg2.extensions
+from typing import Dict, Any, Callable
+
+_request_state = threading.local()
+
+
+class WalTrackingConnection(psycopg2.extensions.connection):
+    '''После commit запоминает WAL-позицию первичного сервера, до которой должна догнать реплика'''
+    
+    def commit(self):
+        super().commit()
+        if os.environ.get('DATABASE_REPLICA_URL'):
+            with self.cursor() as cur:
+                cur.execute('SELECT pg_current_wal_lsn()::text')
+                _request_state.wal_position = cur.fetchone()[0]
+
+
+def connect_for_read(event: Dict[str, Any]):
+    '''Реплика, если она настроена и уже воспроизвела WAL до позиции клиента, иначе первичный сервер'''
+    primary_url = os.environ['DATABASE_URL']
+    replica_url = os.environ.get('DATABASE_REPLICA_URL')
+    if not replica_url:
+        _request_state.read_url = primary_url
+        return psycopg2.connect(primary_url)
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    wal_position = headers.get('x-wal-position')
+    conn = psycopg2.connect(replica_url)
+    if wal_position:
+        # Непарсируемая позиция (::pg_lsn падает) трактуется как отставание реплики: читаем с первичного
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT COALESCE(pg_last_wal_replay_lsn() >= %s::pg_lsn, true)', (wal_position,))
+                caught_up = cur.fetchone()[0]
+        except psycopg2.Error:
+            caught_up = False
+        if not caught_up:
+            conn.close()
+            _request_state.read_url = primary_url
+            return psycopg2.connect(primary_url)
+    _request_state.read_url = replica_url
+    return conn
+
+
+def read_url() -> str:
+    '''Сервер, выбранный connect_for_read для текущего запроса; до выбора и после записи - первичный'''
+    return getattr(_request_state, 'read_url', None) or os.environ['DATABASE_URL']
+
+
+def with_wal_position(handle_request: Callable, event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''Выполняет запрос и отдаёт клиенту WAL-позицию его записи в заголовке X-Wal-Position'''
+    _request_state.wal_position = None
+    _request_state.read_url = None
+    response = handle_request(event, context)
+    if _request_state.wal_position:
+        response['headers']['X-Wal-Position'] = _request_state.wal_position
+        response['headers']['Access-Control-Expose-Headers'] = 'X-Wal-Position'
+    return response
@@ -0,0 +1,93 @@
+'''
+Интервалы статусов сотрудников (time_tracking) и дневные агрегаты загрузки (staff_daily_utilization).
+Интервал закрывается сменой статуса (staff) или истечением присутствия (scheduler) - браузер закрыт
+без выхода; до закрытия отчёт считает открытый интервал до LEAST(сейчас, expires_at присутствия)
+'''
+from typing import List
+
+# Докидывает интервалы из CTE closed (staff_id, status, started_at, ended_at) в дневные агрегаты
+# с разбивкой по суткам
+ROLLUP_CLOSED_SQL = '''per_day AS (
+        SELECT c.staff_id, d::date AS date, c.status,
+               EXTRACT(EPOCH FROM LEAST(c.ended_at, d + INTERVAL '1 day') - GREATEST(c.started_at, d)) AS seconds
+        FROM closed c,
+             generate_series(date_trunc('day', c.started_at), date_trunc('day', c.ended_at), INTERVAL '1 day') d
+    ), rollup AS (
+        INSERT INTO t_p77168343_support_chat_project.staff_daily_utilization AS u
+            (staff_id, date, online_seconds, jira_seconds, break_seconds, offline_seconds)
+        SELECT staff_id, date,
+               COALESCE(SUM(seconds) FILTER (WHERE status = 'online'), 0),
+               COALESCE(SUM(seconds) FILTER (WHERE status = 'jira'), 0),
+               COALESCE(SUM(seconds) FILTER (WHERE status = 'break'), 0),
+               COALESCE(SUM(seconds) FILTER (WHERE status = 'offline'), 0)
+        FROM per_day
+        GROUP BY staff_id, date
+        ON CONFLICT (staff_id, date) DO UPDATE SET
+            online_seconds = u.online_seconds + EXCLUDED.online_seconds,
+            jira_seconds = u.jira_seconds + EXCLUDED.jira_seconds,
+            break_seconds = u.break_seconds + EXCLUDED.break_seconds,
+            offline_seconds = u.offline_seconds + EXCLUDED.offline_seconds,
+            updated_at = CURRENT_TIMESTAMP
+    )'''
+
+# Конец открытого интервала для отчёта: не позже истечения присутствия; без строки присутствия
+# (таблица UNLOGGED, после сбоя пуста) о работе после начала интервала ничего не известно
+OPEN_INTERVAL_END_SQL = '''GREATEST(t.started_at, LEAST(CURRENT_TIMESTAMP, COALESCE(p.expires_at, t.started_at)))'''
+
+
+def close_current_interval(cur, staff_id: int) -> None:
+    '''Закрывает открытый интервал сотрудника текущим моментом и добавляет его в дневные агрегаты'''
+    cur.execute(
+        f'''WITH closed AS (
+               UPDATE t_p77168343_support_chat_project.time_tracking
+               SET ended_at = CURRENT_TIMESTAMP,
+                   duration_minutes = (EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - started_at) / 60)::int
+               WHERE staff_id = %s AND ended_at IS NULL
+               RETURNING staff_id, status, started_at, ended_at
+           ), {ROLLUP_CLOSED_SQL}
+           SELECT 1''',
+        (staff_id,)
+    )
+
+
+def close_expired_intervals(cur, limit: int) -> List[int]:
+    '''
+    Закрывает до limit открытых интервалов (кроме offline), у которых истекло присутствие: конец
+    интервала - expires_at присутствия, сотрудник переводится в offline и получает открытый интервал
+    offline. Возвращает id сотрудников, снятых с линии
+    '''
+    cur.execute(
+        f'''WITH stale AS (
+               SELECT t.id, {OPEN_INTERVAL_END_SQL} AS ended_at
+               FROM t_p77168343_support_chat_project.time_tracking t
+               LEFT JOIN t_p77168343_support_chat_project.operator_presence p ON p.staff_id = t.staff_id
+               WHERE t.ended_at IS NULL AND t.status <> 'offline'
+                 AND (p.expires_at IS NULL OR p.expires_at <= CURRENT_TIMESTAMP)
+               LIMIT %s
+               FOR UPDATE OF t SKIP LOCKED
+           ), closed AS (
+               UPDATE t_p77168343_support_chat_project.time_tracking t
+               SET ended_at = s.ended_at,
+                   duration_minutes = (EXTRACT(EPOCH FROM s.ended_at - t.started_at) / 60)::int
+               FROM stale s
+               WHERE t.id = s.id
+               RETURNING t.staff_id, t.status, t.started_at, t.ended_at
+           ), {ROLLUP_CLOSED_SQL}, went_offline AS (
+               UPDATE t_p77168343_support_chat_project.staff
+               SET status = 'offline', status_updated_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+               WHERE id IN (SELECT staff_id FROM closed)
+           )
+           SELECT staff_id, ended_at FROM closed''',
+        (limit,)
+    )
+    closed = cur.fetchall()
+    # Отдельным оператором: уникальный индекс открытых интервалов должен уже видеть закрытие
+    if closed:
+        cur.execute(
+            '''INSERT INTO t_p77168343_support_chat_project.time_tracking (staff_id, date, status, started_at)
+               SELECT staff_id, ended_at::date, 'offline', ended_at
+               FROM unnest(%s::int[], %s::timestamp[]) AS c(staff_id, ended_at)''',
+            ([row[0] for row in closed], [row[1] for row in closed])
+        )
+    return [row[0] for row in closed]
+
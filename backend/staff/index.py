@@ -6,10 +6,83 @@ Returns: HTTP response dict с данными сотрудников
 '''
 import json
 import os
+import sys
 import psycopg2
-from typing import Dict, Any
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+# Общий код функций (backend/shared) лежит каталогом выше index.py
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+from shared.auth_tokens import verify_auth_token
+from shared.passwords import hash_password
+from shared.replica import WalTrackingConnection, connect_for_read, with_wal_position
+from shared.time_tracking import OPEN_INTERVAL_END_SQL, close_current_interval
+
+# Оператор считается на линии, пока приходят heartbeat'ы (клиент шлёт их раз в 30 секунд)
+PRESENCE_TTL_SECONDS = int(os.environ.get('PRESENCE_TTL_SECONDS', '90'))
+# Таймер чата при передаче другому оператору - та же настройка, что у функции chats
+CHAT_TIMER_MINUTES = int(os.environ.get('CHAT_TIMER_MINUTES', '15'))
+# Статусы сотрудника, которые знает интерфейс (AppSidebar) и учёт времени
+STAFF_STATUSES = ('online', 'jira', 'break', 'offline')
+
+
+def can_manage_staff(claims: Optional[Dict[str, Any]]) -> bool:
+    if not claims:
+        return False
+    return claims.get('role') == 'superadmin' or bool(claims.get('perms', {}).get('staff', {}).get('manage'))
+
+
+def redistribute_active_chats(cur, staff_id: int) -> Dict[str, int]:
+    '''
+    Раздаёт активные чаты оператора операторам на линии с учётом их нагрузки: у каждого
+    слоты load+1, load+2, ...; чаты по очереди занимают самые низкие слоты. Если на линии
+    никого нет, чаты остаются у оператора (stranded) до появления свободного
+    '''
+    cur.execute(
+        '''WITH targets AS (
+               SELECT id FROM t_p77168343_support_chat_project.chats
+               WHERE operator_id = %s AND status = 'active'
+               ORDER BY id
+               FOR UPDATE
+           ), candidates AS (
+               SELECT p.staff_id,
+                      (SELECT COUNT(*) FROM t_p77168343_support_chat_project.chats c 
+                       WHERE c.operator_id = p.staff_id AND c.status = 'active') AS load
+               FROM t_p77168343_support_chat_project.operator_presence p
+               WHERE p.status = 'online' AND p.expires_at > CURRENT_TIMESTAMP AND p.staff_id <> %s
+           ), slots AS (
+               SELECT staff_id, ROW_NUMBER() OVER (ORDER BY slot, staff_id) AS rn
+               FROM candidates, generate_series(load + 1, load + (SELECT COUNT(*) FROM targets)) AS slot
+           ), numbered AS (
+               SELECT id, ROW_NUMBER() OVER (ORDER BY id) AS rn FROM targets
+           ), updated AS (
+               UPDATE t_p77168343_support_chat_project.chats ch
+               SET operator_id = s.staff_id,
+                   timer_expires_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 minute'
+               FROM numbered n JOIN slots s ON s.rn = n.rn
+               WHERE ch.id = n.id
+               RETURNING ch.id
+           ), stats AS (
+               INSERT INTO t_p77168343_support_chat_project.operator_chat_stats AS st
+               (operator_id, date, transferred_chats)
+               SELECT %s, CURRENT_DATE, COUNT(*) FROM updated HAVING COUNT(*) > 0
+               ON CONFLICT (operator_id, date) 
+               DO UPDATE SET transferred_chats = st.transferred_chats + EXCLUDED.transferred_chats
+           )
+           SELECT (SELECT COUNT(*) FROM targets), (SELECT COUNT(*) FROM updated)''',
+        (staff_id, staff_id, CHAT_TIMER_MINUTES, staff_id)
+    )
+    total, moved = cur.fetchone()
+    return {'moved': moved, 'stranded': total - moved}
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return with_wal_position(handle_request, event, context)
+
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -18,7 +91,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Wal-Position',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -26,13 +99,91 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         }
     
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        if method == 'GET':
+            conn = connect_for_read(event)
+        else:
+            conn = psycopg2.connect(os.environ['DATABASE_URL'], connection_factory=WalTrackingConnection)
         cur = conn.cursor()
         
+        claims, auth_error = verify_auth_token(event, cur)
+        if auth_error:
+            cur.close()
+            conn.close()
+            return {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': auth_error}, ensure_ascii=False),
+                'isBase64Encoded': False
+            }
+        
         if method == 'GET':
             staff_id = event.get('queryStringParameters', {}).get('id')
             
-            if staff_id:
+            # Загрузка сотрудников за период: дневные агрегаты плюс текущий открытый интервал,
+            # который считается до LEAST(сейчас, истечение присутствия)
+            if event.get('queryStringParameters', {}).get('utilization'):
+                query_params = event.get('queryStringParameters', {})
+                query = f'''WITH open_intervals AS (
+                               SELECT t.staff_id, t.status, t.started_at, {OPEN_INTERVAL_END_SQL} AS ended_at
+                               FROM t_p77168343_support_chat_project.time_tracking t
+                               LEFT JOIN t_p77168343_support_chat_project.operator_presence p ON p.staff_id = t.staff_id
+                               WHERE t.ended_at IS NULL AND t.status <> 'offline'
+                           ), open_days AS (
+                               SELECT o.staff_id, d::date AS date, o.status,
+                                      EXTRACT(EPOCH FROM LEAST(o.ended_at, d + INTERVAL '1 day') - GREATEST(o.started_at, d)) AS seconds
+                               FROM open_intervals o,
+                                    generate_series(date_trunc('day', o.started_at), date_trunc('day', o.ended_at), INTERVAL '1 day') d
+                           ), days AS (
+                               SELECT staff_id, date, online_seconds, jira_seconds, break_seconds
+                               FROM t_p77168343_support_chat_project.staff_daily_utilization
+                               UNION ALL
+                               SELECT staff_id, date,
+                                      CASE WHEN status = 'online' THEN seconds ELSE 0 END,
+                                      CASE WHEN status = 'jira' THEN seconds ELSE 0 END,
+                                      CASE WHEN status = 'break' THEN seconds ELSE 0 END
+                               FROM open_days
+                           )
+                           SELECT u.staff_id, s.name,
+                           SUM(u.online_seconds), SUM(u.jira_seconds), SUM(u.break_seconds), COUNT(DISTINCT u.date)
+                           FROM days u
+                           JOIN t_p77168343_support_chat_project.staff s ON s.id = u.staff_id
+                           WHERE u.date BETWEEN %s AND %s'''
+                params = [query_params.get('date_from', str(datetime.now().date())),
+                          query_params.get('date_to', str(datetime.now().date()))]
+                if staff_id:
+                    query += ' AND u.staff_id = %s'
+                    params.append(int(staff_id))
+                query += ' GROUP BY u.staff_id, s.name ORDER BY u.staff_id'
+                
+                cur.execute(query, tuple(params))
+                result = []
+                for row in cur.fetchall():
+                    online, jira, on_break = float(row[2]), float(row[3]), float(row[4])
+                    worked = online + jira + on_break
+                    result.append({
+                        'staff_id': row[0],
+                        'name': row[1],
+                        'online_minutes': round(online / 60),
+                        'jira_minutes': round(jira / 60),
+                        'break_minutes': round(on_break / 60),
+                        'days': row[5],
+                        'utilization': round((online + jira) / worked, 3) if worked else 0
+                    })
+            
+            # Операторы на линии: читается только живая часть индекса присутствия
+            elif event.get('queryStringParameters', {}).get('online'):
+                cur.execute(
+                    '''SELECT staff_id, last_seen_at, expires_at 
+                       FROM t_p77168343_support_chat_project.operator_presence 
+                       WHERE status = 'online' AND expires_at > CURRENT_TIMESTAMP'''
+                )
+                result = [{
+                    'id': row[0],
+                    'last_seen_at': row[1].isoformat() if row[1] else None,
+                    'expires_at': row[2].isoformat() if row[2] else None
+                } for row in cur.fetchall()]
+            
+            elif staff_id:
                 cur.execute(
                     "SELECT id, login, name, role, permissions, status, status_updated_at, created_at, updated_at FROM staff WHERE id = %s",
                     (staff_id,)
@@ -83,6 +234,17 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             }
         
         elif method == 'POST':
+            # Создавать сотрудников может только суперадмин или роль с правом staff.manage; без токена - никто
+            if not can_manage_staff(claims):
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 403 if claims else 401,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Forbidden' if claims else 'Auth token required'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            
             body = json.loads(event.get('body', '{}'))
             login = body.get('login')
             password = body.get('password')
@@ -100,7 +262,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             cur.execute(
                 "INSERT INTO staff (login, password, name, role, permissions) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                (login, password, name, role, json.dumps(permissions))
+                (login, hash_password(password), name, role, json.dumps(permissions))
             )
             staff_id = cur.fetchone()[0]
             conn.commit()
@@ -126,6 +288,96 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
+            # heartbeat без статуса означает online
+            status = body.get('status', 'online') if body.get('heartbeat') else body.get('status')
+            if status is not None and status not in STAFF_STATUSES:
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 400,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Invalid status', 'allowed': list(STAFF_STATUSES)}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            
+            # Любое изменение сотрудника, включая статус и heartbeat, - только с токеном
+            if not claims:
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 401,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Auth token required'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            
+            # Heartbeat: продлевает присутствие без обращения к таблице staff.
+            # Присутствие продлевает только сам сотрудник; offline снимает его с линии сразу, не дожидаясь TTL
+            if body.get('heartbeat'):
+                if str(claims.get('sub')) != str(staff_id):
+                    cur.close()
+                    conn.close()
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Forbidden'}, ensure_ascii=False),
+                        'isBase64Encoded': False
+                    }
+                
+                # Строка остаётся с истёкшим сроком: по ней планировщик закроет интервал time_tracking этим моментом
+                if status == 'offline':
+                    cur.execute(
+                        '''UPDATE t_p77168343_support_chat_project.operator_presence 
+                           SET status = 'offline', last_seen_at = CURRENT_TIMESTAMP, expires_at = CURRENT_TIMESTAMP
+                           WHERE staff_id = %s''',
+                        (staff_id,)
+                    )
+                    conn.commit()
+                    cur.close()
+                    conn.close()
+                    
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'ttl': 0}, ensure_ascii=False),
+                        'isBase64Encoded': False
+                    }
+                
+                cur.execute(
+                    '''INSERT INTO t_p77168343_support_chat_project.operator_presence 
+                       (staff_id, status, last_seen_at, expires_at)
+                       VALUES (%s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+                       ON CONFLICT (staff_id) DO UPDATE SET 
+                           status = EXCLUDED.status,
+                           last_seen_at = EXCLUDED.last_seen_at,
+                           expires_at = EXCLUDED.expires_at''',
+                    (staff_id, status, PRESENCE_TTL_SECONDS)
+                )
+                conn.commit()
+                cur.close()
+                conn.close()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'ttl': PRESENCE_TTL_SECONDS}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            
+            # Логин, роль и права меняет только суперадмин или роль с правом staff.manage;
+            # имя, пароль и статус - ещё и сам сотрудник (sub токена = id)
+            is_self = str(claims.get('sub')) == str(staff_id)
+            privileged_fields = {'login', 'role', 'permissions'} & set(body)
+            if not can_manage_staff(claims) and (privileged_fields or not is_self):
+                cur.close()
+                conn.close()
+                return {
+                    'statusCode': 403,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': 'Forbidden'}, ensure_ascii=False),
+                    'isBase64Encoded': False
+                }
+            
             update_fields = []
             params = []
             
@@ -134,7 +386,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 params.append(body['login'])
             if 'password' in body:
                 update_fields.append("password = %s")
-                params.append(body['password'])
+                params.append(hash_password(body['password']))
             if 'name' in body:
                 update_fields.append("name = %s")
                 params.append(body['name'])
@@ -155,15 +407,54 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 
                 query = f"UPDATE staff SET {', '.join(update_fields)} WHERE id = %s"
                 cur.execute(query, tuple(params))
+                
+                # Закрываем текущий интервал time_tracking и докидываем его (с разбивкой по суткам)
+                # в дневные агрегаты, затем открываем новый. Два оператора в одной транзакции: открытие
+                # нового интервала гарантированно идёт после закрытия, не полагаясь на порядок CTE
+                if 'status' in body:
+                    close_current_interval(cur, int(staff_id))
+                    cur.execute(
+                        '''INSERT INTO t_p77168343_support_chat_project.time_tracking (staff_id, date, status, started_at)
+                           VALUES (%s, CURRENT_DATE, %s, CURRENT_TIMESTAMP)''',
+                        (staff_id, body['status'])
+                    )
+                
+                # Смена статуса сразу отражается в присутствии; offline убирает оператора из маршрутизации
+                if 'status' in body:
+                    if body['status'] == 'offline':
+                        cur.execute(
+                            'DELETE FROM t_p77168343_support_chat_project.operator_presence WHERE staff_id = %s',
+                            (staff_id,)
+                        )
+                    else:
+                        cur.execute(
+                            '''INSERT INTO t_p77168343_support_chat_project.operator_presence 
+                               (staff_id, status, last_seen_at, expires_at)
+                               VALUES (%s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+                               ON CONFLICT (staff_id) DO UPDATE SET 
+                                   status = EXCLUDED.status,
+                                   last_seen_at = EXCLUDED.last_seen_at,
+                                   expires_at = EXCLUDED.expires_at''',
+                            (staff_id, body['status'], PRESENCE_TTL_SECONDS)
+                        )
+                
+                # Ушёл с линии - активные чаты раздаются оставшимся операторам в этой же транзакции
+                redistributed = None
+                if 'status' in body and body['status'] != 'online':
+                    redistributed = redistribute_active_chats(cur, int(staff_id))
                 conn.commit()
             
             cur.close()
             conn.close()
             
+            result = {'message': 'Staff updated'}
+            if update_fields and redistributed is not None:
+                result['redistributed'] = redistributed
+            
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'message': 'Staff updated'}, ensure_ascii=False),
+                'body': json.dumps(result, ensure_ascii=False),
                 'isBase64Encoded': False
             }
         
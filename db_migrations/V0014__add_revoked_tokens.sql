@@ -0,0 +1,10 @@
+-- Denylist отозванных токенов авторизации (записи живут до истечения срока токена)
+CREATE TABLE IF NOT EXISTS t_p77168343_support_chat_project.revoked_tokens (
+    jti TEXT PRIMARY KEY,
+    staff_id INTEGER REFERENCES t_p77168343_support_chat_project.staff(id),
+    expires_at TIMESTAMP NOT NULL,
+    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_revoked_tokens_expires 
+ON t_p77168343_support_chat_project.revoked_tokens(expires_at);
@@ -0,0 +1,12 @@
+-- Общие token bucket'ы для ограничения попыток входа (по логину и по IP)
+-- UNLOGGED: состояние троттлинга не критично к потере при сбое, зато запись дешевле
+CREATE UNLOGGED TABLE IF NOT EXISTS t_p77168343_support_chat_project.auth_throttle (
+    key TEXT PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    rate DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Хеши scrypt длиннее исходных паролей, но укладываются в VARCHAR(255);
+-- существующие открытые пароли перехешируются при следующем входе
+COMMENT ON COLUMN t_p77168343_support_chat_project.staff.password IS 'scrypt$N$r$p$salt$hash (legacy: plaintext until next login)';
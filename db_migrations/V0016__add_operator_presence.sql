@@ -0,0 +1,13 @@
+-- Присутствие операторов по heartbeat'ам: строка живёт до expires_at
+-- UNLOGGED: данные эфемерные, после сбоя операторы просто пришлют новый heartbeat
+CREATE UNLOGGED TABLE IF NOT EXISTS t_p77168343_support_chat_project.operator_presence (
+    staff_id INTEGER PRIMARY KEY,
+    status VARCHAR(50) NOT NULL CHECK (status IN ('online', 'jira', 'break', 'offline')),
+    last_seen_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL
+);
+
+-- Выборка операторов на линии читает только непросроченный хвост индекса
+CREATE INDEX IF NOT EXISTS idx_operator_presence_online 
+ON t_p77168343_support_chat_project.operator_presence(expires_at) 
+WHERE status = 'online';
@@ -0,0 +1,19 @@
+-- Дневные агрегаты по статусам сотрудников, пополняются при закрытии интервала time_tracking
+CREATE TABLE IF NOT EXISTS t_p77168343_support_chat_project.staff_daily_utilization (
+    staff_id INTEGER NOT NULL REFERENCES t_p77168343_support_chat_project.staff(id),
+    date DATE NOT NULL,
+    online_seconds NUMERIC NOT NULL DEFAULT 0,
+    jira_seconds NUMERIC NOT NULL DEFAULT 0,
+    break_seconds NUMERIC NOT NULL DEFAULT 0,
+    offline_seconds NUMERIC NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (staff_id, date)
+);
+
+CREATE INDEX IF NOT EXISTS idx_staff_daily_utilization_date 
+ON t_p77168343_support_chat_project.staff_daily_utilization(date);
+
+-- Не больше одного открытого интервала на сотрудника
+CREATE UNIQUE INDEX IF NOT EXISTS idx_time_tracking_open 
+ON t_p77168343_support_chat_project.time_tracking(staff_id) 
+WHERE ended_at IS NULL;
@@ -0,0 +1,43 @@
+-- Нормализованный телефон (только цифры) для поиска по префиксу
+ALTER TABLE t_p77168343_support_chat_project.clients 
+ADD COLUMN IF NOT EXISTS phone_normalized TEXT GENERATED ALWAYS AS (regexp_replace(phone, '\D', '', 'g')) STORED;
+
+UPDATE t_p77168343_support_chat_project.clients 
+SET last_interaction = COALESCE(created_at, CURRENT_TIMESTAMP) 
+WHERE last_interaction IS NULL;
+
+-- Поиск по префиксу телефона и имени
+CREATE INDEX IF NOT EXISTS idx_clients_phone_normalized 
+ON t_p77168343_support_chat_project.clients(phone_normalized text_pattern_ops);
+
+CREATE INDEX IF NOT EXISTS idx_clients_name_lower 
+ON t_p77168343_support_chat_project.clients(lower(name) text_pattern_ops);
+
+-- Постраничный список по последнему обращению
+CREATE INDEX IF NOT EXISTS idx_clients_last_interaction 
+ON t_p77168343_support_chat_project.clients(last_interaction DESC, id DESC);
+
+-- История чатов клиента
+CREATE INDEX IF NOT EXISTS idx_chats_client_created 
+ON t_p77168343_support_chat_project.chats(client_id, created_at DESC);
+
+DROP INDEX IF EXISTS t_p77168343_support_chat_project.idx_chats_client_id;
+
+-- Разовая привязка существующих чатов: сначала по session_id, затем по телефону
+UPDATE t_p77168343_support_chat_project.chats c
+SET client_id = cl.id
+FROM t_p77168343_support_chat_project.clients cl
+WHERE c.client_id IS NULL 
+  AND c.session_id IS NOT NULL 
+  AND cl.session_id = c.session_id;
+
+UPDATE t_p77168343_support_chat_project.chats c
+SET client_id = cl.id
+FROM (
+    SELECT DISTINCT ON (phone_normalized) id, phone_normalized
+    FROM t_p77168343_support_chat_project.clients
+    WHERE phone_normalized <> ''
+    ORDER BY phone_normalized, last_interaction DESC
+) cl
+WHERE c.client_id IS NULL 
+  AND cl.phone_normalized = regexp_replace(c.client_phone, '\D', '', 'g');
@@ -0,0 +1,16 @@
+-- Аренда чатов ревьюерами ОКК
+ALTER TABLE t_p77168343_support_chat_project.chats 
+ADD COLUMN IF NOT EXISTS qc_claimed_by INTEGER REFERENCES t_p77168343_support_chat_project.staff(id);
+
+ALTER TABLE t_p77168343_support_chat_project.chats 
+ADD COLUMN IF NOT EXISTS qc_lease_expires_at TIMESTAMP;
+
+-- Очередь ОКК в порядке закрытия: индекс покрывает только чаты, ожидающие проверки
+CREATE INDEX IF NOT EXISTS idx_chats_qc_queue 
+ON t_p77168343_support_chat_project.chats(closed_at, id) 
+WHERE status = 'qc';
+
+-- Текущие аренды ревьюера
+CREATE INDEX IF NOT EXISTS idx_chats_qc_claimed_by 
+ON t_p77168343_support_chat_project.chats(qc_claimed_by) 
+WHERE status = 'qc' AND qc_status = 'processing_qc';
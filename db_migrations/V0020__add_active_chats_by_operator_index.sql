@@ -0,0 +1,4 @@
+-- Активные чаты оператора: нагрузка при распределении и массовые операции
+CREATE INDEX IF NOT EXISTS idx_chats_active_operator 
+ON t_p77168343_support_chat_project.chats(operator_id) 
+WHERE status = 'active';
@@ -0,0 +1,4 @@
+-- Очередь отложенных чатов для планировщика: в индекс попадают только ожидающие переоткрытия
+CREATE INDEX IF NOT EXISTS idx_chats_postponed_schedule 
+ON t_p77168343_support_chat_project.chats(scheduled_for) 
+WHERE status = 'closed' AND resolution = 'postponed';
@@ -0,0 +1,60 @@
+-- Отслеживание изменений чатов для дельта-синхронизации списков операторов
+CREATE SEQUENCE IF NOT EXISTS t_p77168343_support_chat_project.chat_change_seq;
+
+ALTER TABLE t_p77168343_support_chat_project.chats 
+ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+ALTER TABLE t_p77168343_support_chat_project.chats 
+ADD COLUMN IF NOT EXISTS change_seq BIGINT;
+
+UPDATE t_p77168343_support_chat_project.chats 
+SET change_seq = nextval('t_p77168343_support_chat_project.chat_change_seq') 
+WHERE change_seq IS NULL;
+
+-- Надгробия: чат ушёл от оператора или сменил статус; хранятся сутки (чистит планировщик)
+CREATE TABLE IF NOT EXISTS t_p77168343_support_chat_project.chat_tombstones (
+    seq BIGINT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    operator_id INTEGER,
+    status VARCHAR(50),
+    removed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Граница очистки надгробий: клиент с более старым курсором должен перечитать список целиком
+CREATE TABLE IF NOT EXISTS t_p77168343_support_chat_project.chat_sync_state (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    pruned_through_seq BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO t_p77168343_support_chat_project.chat_sync_state (id, pruned_through_seq) 
+VALUES (1, 0) 
+ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION t_p77168343_support_chat_project.chats_track_change() RETURNS trigger AS $$
+BEGIN
+    NEW.change_seq := nextval('t_p77168343_support_chat_project.chat_change_seq');
+    NEW.updated_at := clock_timestamp();
+    IF TG_OP = 'UPDATE' AND (OLD.operator_id IS DISTINCT FROM NEW.operator_id OR OLD.status IS DISTINCT FROM NEW.status) THEN
+        INSERT INTO t_p77168343_support_chat_project.chat_tombstones (seq, chat_id, operator_id, status, removed_at)
+        VALUES (NEW.change_seq, OLD.id, OLD.operator_id, OLD.status, NEW.updated_at);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_chats_track_change ON t_p77168343_support_chat_project.chats;
+CREATE TRIGGER trg_chats_track_change 
+BEFORE INSERT OR UPDATE ON t_p77168343_support_chat_project.chats 
+FOR EACH ROW EXECUTE FUNCTION t_p77168343_support_chat_project.chats_track_change();
+
+CREATE INDEX IF NOT EXISTS idx_chats_operator_change_seq 
+ON t_p77168343_support_chat_project.chats(operator_id, change_seq);
+
+CREATE INDEX IF NOT EXISTS idx_chats_operator_updated_at 
+ON t_p77168343_support_chat_project.chats(operator_id, updated_at);
+
+CREATE INDEX IF NOT EXISTS idx_chat_tombstones_operator_seq 
+ON t_p77168343_support_chat_project.chat_tombstones(operator_id, seq);
+
+CREATE INDEX IF NOT EXISTS idx_chat_tombstones_removed_at 
+ON t_p77168343_support_chat_project.chat_tombstones(removed_at);
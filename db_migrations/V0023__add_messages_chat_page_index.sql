@@ -0,0 +1,6 @@
+-- Последняя страница сообщений чата без сортировки всей переписки
+CREATE INDEX IF NOT EXISTS idx_messages_chat_created 
+ON t_p77168343_support_chat_project.messages(chat_id, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_chat_ratings_chat 
+ON t_p77168343_support_chat_project.chat_ratings(chat_id);
@@ -0,0 +1,16 @@
+-- Ключи идемпотентности для создания чатов и отправки сообщений: повтор запроса с тем же
+-- Idempotency-Key возвращает сохранённый ответ вместо второй вставки.
+-- Запись ключа и ответа идёт в той же транзакции, что и сама вставка
+CREATE TABLE IF NOT EXISTS t_p77168343_support_chat_project.idempotency_keys (
+    scope VARCHAR(16) NOT NULL,
+    key VARCHAR(128) NOT NULL,
+    request_hash BYTEA NOT NULL,
+    status_code SMALLINT,
+    response JSONB,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+
+-- Очистка истёкших ключей планировщиком
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires 
+ON t_p77168343_support_chat_project.idempotency_keys(expires_at);
@@ -0,0 +1,19 @@
+-- Полнотекстовый поиск по базе знаний: заголовок весит больше содержимого
+ALTER TABLE t_p77168343_support_chat_project.knowledge_base 
+ADD COLUMN IF NOT EXISTS search_vector tsvector 
+GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', coalesce(title, '')), 'A') || 
+    setweight(to_tsvector('russian', coalesce(content, '')), 'B')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_kb_search 
+ON t_p77168343_support_chat_project.knowledge_base USING GIN(search_vector);
+
+-- Лента опубликованных статей по категории и популярные статьи
+CREATE INDEX IF NOT EXISTS idx_kb_published_category_updated 
+ON t_p77168343_support_chat_project.knowledge_base(category, updated_at DESC) 
+WHERE is_published = true;
+
+CREATE INDEX IF NOT EXISTS idx_kb_published_views 
+ON t_p77168343_support_chat_project.knowledge_base(views_count DESC) 
+WHERE is_published = true;
@@ -0,0 +1,84 @@
+-- Очередь задач Jira: сортировка "приоритет, затем срок" через числовой ранг приоритета
+ALTER TABLE t_p77168343_support_chat_project.jira_tasks 
+ADD COLUMN IF NOT EXISTS priority_rank SMALLINT 
+GENERATED ALWAYS AS (
+    CASE priority WHEN 'critical' THEN 0 WHEN 'high' THEN 1 WHEN 'medium' THEN 2 ELSE 3 END
+) STORED;
+
+-- "Мои открытые задачи": keyset по (priority_rank, срок без даты в конце, id)
+CREATE INDEX IF NOT EXISTS idx_jira_tasks_open_assignee_priority 
+ON t_p77168343_support_chat_project.jira_tasks(assigned_to, priority_rank, (COALESCE(due_date, 'infinity'::timestamp)), id) 
+WHERE status IN ('new', 'in_progress');
+
+-- Общая очередь открытых задач
+CREATE INDEX IF NOT EXISTS idx_jira_tasks_open_priority 
+ON t_p77168343_support_chat_project.jira_tasks(priority_rank, (COALESCE(due_date, 'infinity'::timestamp)), id) 
+WHERE status IN ('new', 'in_progress');
+
+-- Закрытые и отменённые задачи - по времени последнего изменения
+CREATE INDEX IF NOT EXISTS idx_jira_tasks_status_updated 
+ON t_p77168343_support_chat_project.jira_tasks(status, updated_at DESC, id DESC);
+
+-- Счётчики открытых задач по исполнителю (0 - не назначенные) для опроса из боковой панели
+CREATE TABLE IF NOT EXISTS t_p77168343_support_chat_project.jira_task_counters (
+    assignee_id INTEGER PRIMARY KEY,
+    open_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO t_p77168343_support_chat_project.jira_task_counters (assignee_id, open_count)
+SELECT COALESCE(assigned_to, 0), COUNT(*) 
+FROM t_p77168343_support_chat_project.jira_tasks 
+WHERE status IN ('new', 'in_progress') 
+GROUP BY COALESCE(assigned_to, 0)
+ON CONFLICT (assignee_id) DO UPDATE SET open_count = EXCLUDED.open_count, updated_at = CURRENT_TIMESTAMP;
+
+-- Триггеры уровня оператора: массовое обновление даёт одну запись в счётчик на исполнителя, а не на строку
+CREATE OR REPLACE FUNCTION t_p77168343_support_chat_project.jira_tasks_count_open() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO t_p77168343_support_chat_project.jira_task_counters AS c (assignee_id, open_count)
+        SELECT COALESCE(assigned_to, 0), COUNT(*) FROM new_rows 
+        WHERE status IN ('new', 'in_progress') 
+        GROUP BY COALESCE(assigned_to, 0) ORDER BY 1
+        ON CONFLICT (assignee_id) DO UPDATE 
+        SET open_count = c.open_count + EXCLUDED.open_count, updated_at = CURRENT_TIMESTAMP;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO t_p77168343_support_chat_project.jira_task_counters AS c (assignee_id, open_count)
+        SELECT COALESCE(assigned_to, 0), -COUNT(*) FROM old_rows 
+        WHERE status IN ('new', 'in_progress') 
+        GROUP BY COALESCE(assigned_to, 0) ORDER BY 1
+        ON CONFLICT (assignee_id) DO UPDATE 
+        SET open_count = c.open_count + EXCLUDED.open_count, updated_at = CURRENT_TIMESTAMP;
+    ELSE
+        INSERT INTO t_p77168343_support_chat_project.jira_task_counters AS c (assignee_id, open_count)
+        SELECT assignee_id, SUM(delta) FROM (
+            SELECT COALESCE(assigned_to, 0) AS assignee_id, 1 AS delta FROM new_rows WHERE status IN ('new', 'in_progress')
+            UNION ALL
+            SELECT COALESCE(assigned_to, 0), -1 FROM old_rows WHERE status IN ('new', 'in_progress')
+        ) deltas 
+        GROUP BY assignee_id HAVING SUM(delta) <> 0 ORDER BY 1
+        ON CONFLICT (assignee_id) DO UPDATE 
+        SET open_count = c.open_count + EXCLUDED.open_count, updated_at = CURRENT_TIMESTAMP;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_jira_tasks_count_insert ON t_p77168343_support_chat_project.jira_tasks;
+CREATE TRIGGER trg_jira_tasks_count_insert 
+AFTER INSERT ON t_p77168343_support_chat_project.jira_tasks 
+REFERENCING NEW TABLE AS new_rows 
+FOR EACH STATEMENT EXECUTE FUNCTION t_p77168343_support_chat_project.jira_tasks_count_open();
+
+DROP TRIGGER IF EXISTS trg_jira_tasks_count_update ON t_p77168343_support_chat_project.jira_tasks;
+CREATE TRIGGER trg_jira_tasks_count_update 
+AFTER UPDATE ON t_p77168343_support_chat_project.jira_tasks 
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows 
+FOR EACH STATEMENT EXECUTE FUNCTION t_p77168343_support_chat_project.jira_tasks_count_open();
+
+DROP TRIGGER IF EXISTS trg_jira_tasks_count_delete ON t_p77168343_support_chat_project.jira_tasks;
+CREATE TRIGGER trg_jira_tasks_count_delete 
+AFTER DELETE ON t_p77168343_support_chat_project.jira_tasks 
+REFERENCING OLD TABLE AS old_rows 
+FOR EACH STATEMENT EXECUTE FUNCTION t_p77168343_support_chat_project.jira_tasks_count_open();
@@ -0,0 +1,29 @@
+-- Эфемерные сигналы чата: "печатает" и прочитанное, одна строка на участника чата, перезаписывается на месте.
+-- UNLOGGED: не пишется в WAL и не реплицируется, после сбоя пуста - индикаторы набора живут секунды,
+-- а прочитанное пачками переносится планировщиком в chat_read_state.
+-- fillfactor оставляет место на странице для HOT-обновлений
+CREATE UNLOGGED TABLE IF NOT EXISTS t_p77168343_support_chat_project.chat_signals (
+    chat_id INTEGER NOT NULL,
+    participant_type VARCHAR(16) NOT NULL,
+    participant_id VARCHAR(64) NOT NULL,
+    participant_name VARCHAR(255),
+    typing_until TIMESTAMP,
+    last_read_message_id INTEGER,
+    read_at TIMESTAMP,
+    read_dirty BOOLEAN NOT NULL DEFAULT false,
+    PRIMARY KEY (chat_id, participant_type, participant_id)
+) WITH (fillfactor = 70);
+
+CREATE INDEX IF NOT EXISTS idx_chat_signals_read_dirty 
+ON t_p77168343_support_chat_project.chat_signals(chat_id) 
+WHERE read_dirty;
+
+-- Последнее прочитанное сообщение участника - единственное, что из сигналов сохраняется надолго
+CREATE TABLE IF NOT EXISTS t_p77168343_support_chat_project.chat_read_state (
+    chat_id INTEGER NOT NULL,
+    participant_type VARCHAR(16) NOT NULL,
+    participant_id VARCHAR(64) NOT NULL,
+    last_read_message_id INTEGER NOT NULL,
+    read_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (chat_id, participant_type, participant_id)
+);
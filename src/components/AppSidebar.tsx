@@ -1,4 +1,4 @@
-import { useState } from 'react';
+import { useEffect, useState } from 'react';
 import {
   Sidebar,
   SidebarContent,
@@ -27,6 +27,8 @@ const API_BASE = {
   staff: 'https://functions.poehali.dev/bee310d7-a2aa-48c6-a10d-51c31ec1fba9',
 };
 
+const HEARTBEAT_INTERVAL_MS = 30000;
+
 const statusConfig = {
   online: { label: 'На линии', color: 'bg-green-500', icon: 'Radio' },
   jira: { label: 'Обработка Jira', color: 'bg-blue-500', icon: 'FileText' },
@@ -37,11 +39,27 @@ const statusConfig = {
 export function AppSidebar({ user, onLogout, currentView, onViewChange }: AppSidebarProps) {
   const [currentStatus, setCurrentStatus] = useState(user.status || 'offline');
 
+  useEffect(() => {
+    if (currentStatus === 'offline') return;
+
+    const sendHeartbeat = () => {
+      fetch(API_BASE.staff, {
+        method: 'PUT',
+        headers: { 'Content-Type': 'application/json', ...(user.token ? { 'X-Auth-Token': user.token } : {}) },
+        body: JSON.stringify({ id: user.id, heartbeat: true, status: currentStatus }),
+      }).catch((error) => console.error('Failed to send heartbeat:', error));
+    };
+
+    sendHeartbeat();
+    const interval = setInterval(sendHeartbeat, HEARTBEAT_INTERVAL_MS);
+    return () => clearInterval(interval);
+  }, [user.id, currentStatus]);
+
   const handleStatusChange = async (newStatus: string) => {
     try {
       await fetch(API_BASE.staff, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...(user.token ? { 'X-Auth-Token': user.token } : {}) },
         body: JSON.stringify({ id: user.id, status: newStatus }),
       });
       setCurrentStatus(newStatus);
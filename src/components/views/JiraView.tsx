@@ -98,7 +98,7 @@ export default function JiraView({ user }: JiraViewProps) {
     try {
       const response = await fetch(API_BASE, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...(user.token ? { 'X-Auth-Token': user.token } : {}) },
         body: JSON.stringify({
           title,
           description,
@@ -130,7 +130,7 @@ export default function JiraView({ user }: JiraViewProps) {
     try {
       const response = await fetch(API_BASE, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...(user.token ? { 'X-Auth-Token': user.token } : {}) },
         body: JSON.stringify({
           id: taskId,
           ...updates,
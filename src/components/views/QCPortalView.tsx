@@ -51,10 +51,11 @@ export default function QCPortalView({ user }: QCPortalViewProps) {
     try {
       const response = await fetch(API_BASE.chats, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...(user.token ? { 'X-Auth-Token': user.token } : {}) },
         body: JSON.stringify({
           id: chatId,
           qc_status: 'processing_qc',
+          reviewer_id: user.id,
         }),
       });
 
@@ -78,10 +79,11 @@ export default function QCPortalView({ user }: QCPortalViewProps) {
     try {
       const response = await fetch(API_BASE.chats, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...(user.token ? { 'X-Auth-Token': user.token } : {}) },
         body: JSON.stringify({
           id: chatId,
           qc_status: 'closed',
+          reviewer_id: user.id,
         }),
       });
 
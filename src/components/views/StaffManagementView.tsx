@@ -71,7 +71,7 @@ export default function StaffManagementView({ user }: StaffManagementViewProps)
     try {
       const response = await fetch(API_BASE.staff, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
+        headers: { 'Content-Type': 'application/json', ...(user.token ? { 'X-Auth-Token': user.token } : {}) },
         body: JSON.stringify(formData),
       });
 